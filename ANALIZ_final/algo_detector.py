@@ -1,10 +1,45 @@
-from collections import Counter
-from datetime import datetime, timedelta
 import logging
+import numpy as np
+
+def _find_clusters(times_ns: np.ndarray, qty_cumsum: np.ndarray, window_ns: int = 5_000_000_000, min_size: int = 3):
+    """
+    Ищет кластеры сделок: не менее min_size сделок в пределах window_ns от первой сделки кластера.
+    times_ns — время сделок в наносекундах, отсортированное по возрастанию: окно ищется через np.searchsorted,
+    на неотсортированном массиве результат неверен. qty_cumsum — не объёмы сделок, а их префиксные суммы
+    длины n + 1 с ведущим нулём (np.concatenate(([0], np.cumsum(qty)))).
+    Возвращает массивы (start, end, count, volume), где [start, end) — полуинтервал индексов сделок кластера.
+    """
+    n = len(times_ns)
+    # Для каждой сделки — индекс первой сделки, вышедшей за окно от неё
+    window_end = np.searchsorted(times_ns, times_ns + window_ns, side='right')
+    candidates = np.flatnonzero(window_end - np.arange(n) >= min_size)
+    starts = []
+    pos = 0
+    # Цикл идёт только по найденным кластерам, а не по всем сделкам
+    while pos < len(candidates):
+        start = candidates[pos]
+        starts.append(start)
+        # Следующий кластер может начаться только после конца текущего
+        pos = np.searchsorted(candidates, window_end[start], side='left')
+
+    starts = np.asarray(starts, dtype=np.int64)
+    ends = window_end[starts]
+    # Объём кластера [start, end) — разность префиксных сумм, O(1) на кластер
+    volumes = qty_cumsum[ends] - qty_cumsum[starts]
+    return starts, ends, ends - starts, volumes
 
 class AlgoDetector:
     def __init__(self, large_trades: list):
         self.large_trades = large_trades
+        # Время и объём сделок в виде массивов NumPy: TRADETIME разбирается один раз
+        # C-парсером NumPy, дальше все секции работают с готовым datetime64
+        self._times = np.array([t['TRADETIME'] for t in large_trades], dtype='datetime64[ns]')
+        self._qty = np.fromiter((t['QUANTITY'] for t in large_trades), dtype=np.int64, count=len(large_trades))
+        self._price = np.fromiter((t['PRICE'] for t in large_trades), dtype=np.float64, count=len(large_trades))
+        # Префиксные суммы объёма: объём любого отрезка сделок считается одной разностью
+        self._qty_cumsum = np.concatenate(([0], np.cumsum(self._qty)))
+        # Список крупных сделок за прогон не меняется, поэтому сигналы считаются один раз
+        self._signals = None
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
     def _fmt(self, value):
@@ -14,99 +49,87 @@ class AlgoDetector:
         except Exception:
             return str(value)
 
+    def _fmt_time(self, value):
+        """Форматирует np.datetime64 как ЧЧ:ММ:СС."""
+        # 'YYYY-MM-DDTHH:MM:SS' -> 'HH:MM:SS' без создания объекта datetime
+        return np.datetime_as_string(value, unit='s')[11:19]
+
+    def _most_frequent(self, values: np.ndarray, min_count: int = 5, top_n: int = 3, source=None) -> list[tuple]:
+        """
+        Возвращает до top_n самых частых значений (встречающихся не реже min_count раз).
+        Если передан source, значение берется из него по индексу первого появления — в исходном виде
+        (целая цена выводится как 250, а не 250.0 из массива float64).
+        """
+        vals, first_idx, counts = np.unique(values, return_index=True, return_counts=True)
+        keep = counts >= min_count
+        vals, first_idx, counts = vals[keep], first_idx[keep], counts[keep]
+        # По убыванию частоты, при равенстве — в порядке первого появления
+        order = np.lexsort((first_idx, -counts))[:top_n]
+        if source is not None:
+            return [(source[first_idx[i]], int(counts[i])) for i in order]
+        return [(vals[i].item(), int(counts[i])) for i in order]
+
     def detect_algo_signals(self) -> list[str]:
         """
         Анализирует крупные сделки на предмет признаков алгоритмической торговли
         или активности маркет-мейкера, предоставляя более детальную информацию.
+        Результат кэшируется в экземпляре; вызывающий код получает копию списка.
         """
+        if self._signals is None:
+            self._signals = self._compute_signals()
+        return list(self._signals)
+
+    def _compute_signals(self) -> list[str]:
+        """Выполняет все проверки детектора и возвращает список сигналов."""
         signals = []
 
         if not self.large_trades:
             return ["Нет данных о крупных сделках для анализа алгоритмов."]
 
         # 1. Серии сделок с одинаковым объёмом
-        qty_counter = Counter([t['QUANTITY'] for t in self.large_trades if t['QUANTITY'] > 0])
-        # Сортируем по убыванию частоты и берем топ-3
-        frequent_qty_sorted = sorted([item for item in qty_counter.items() if item[1] >= 5], key=lambda x: x[1], reverse=True)[:3]
+        frequent_qty_sorted = self._most_frequent(self._qty[self._qty > 0])
         if frequent_qty_sorted:
             qty_details = "; ".join([f"{self._fmt(q)} лотов ({count} раз)" for q, count in frequent_qty_sorted])
             signals.append(f"Обнаружены серии сделок с одинаковым объёмом: {qty_details} — это может быть признаком работы торгового алгоритма, осуществляющего единообразные входы или выходы.")
 
         # 2. Частые сделки (интервал < 2 сек)
-        try:
-            times = [datetime.fromisoformat(t['TRADETIME']) for t in self.large_trades]
-            intervals = [(t2 - t1).total_seconds() for t1, t2 in zip(times, times[1:])]
-            fast_trades_intervals = [dt for dt in intervals if dt < 2]
-            fast_count = len(fast_trades_intervals)
+        if len(self._times) >= 2:
+            intervals_ms = np.diff(self._times).astype('timedelta64[ms]').astype(np.int64)
+            fast = intervals_ms < 2000
+            fast_count = int(np.count_nonzero(fast))
 
             if fast_count > 10:  # Порог для определения "многих" быстрых сделок
-                # Поиск наиболее интенсивного периода быстрых сделок
-                max_fast_seq = 0
-                current_fast_seq = 0
-                start_time_seq = None
-                end_time_seq = None
-
-                for i in range(len(intervals)):
-                    if intervals[i] < 2:
-                        current_fast_seq += 1
-                        if current_fast_seq == 1:
-                            start_time_seq = times[i]
-                        end_time_seq = times[i+1]
-                    else:
-                        if current_fast_seq > max_fast_seq:
-                            max_fast_seq = current_fast_seq
-                            # end_time_seq уже обновлен
-                        current_fast_seq = 0
-                        start_time_seq = None
-                # Проверяем последовательность в конце списка
-                if current_fast_seq > max_fast_seq:
-                    max_fast_seq = current_fast_seq
+                # Поиск наиболее интенсивного периода быстрых сделок: границы серий подряд идущих быстрых интервалов
+                edges = np.diff(np.r_[0, fast.astype(np.int8), 0])
+                run_starts = np.flatnonzero(edges == 1)
+                run_ends = np.flatnonzero(edges == -1)
+                run_lens = run_ends - run_starts
+                k = int(run_lens.argmax())
+                max_fast_seq = int(run_lens[k])
+                # Серия из L быстрых интервалов охватывает сделки с run_starts[k] по run_ends[k]
+                start_time_seq = self._times[run_starts[k]]
+                end_time_seq = self._times[run_ends[k]]
 
                 time_info = ""
-                if max_fast_seq > 1 and start_time_seq and end_time_seq:
-                    time_info = f" (наиболее интенсивная серия: {max_fast_seq} сделок за {(end_time_seq - start_time_seq).total_seconds():.1f} сек. c {start_time_seq.strftime('%H:%M:%S')} до {end_time_seq.strftime('%H:%M:%S')})"
+                if max_fast_seq > 1:
+                    duration = (end_time_seq - start_time_seq) / np.timedelta64(1, 's')
+                    time_info = f" (наиболее интенсивная серия: {max_fast_seq} сделок за {duration:.1f} сек. c {self._fmt_time(start_time_seq)} до {self._fmt_time(end_time_seq)})"
 
                 signals.append(f"Обнаружено {fast_count} серий быстрых сделок (интервал <2 сек){time_info} — это может указывать на высокочастотную активность или работу агрессивных алгоритмов.")
-        except Exception as e:
-            logging.error(f"Ошибка при анализе частых сделок: {e}")
 
         # 3. Кластеры по времени (>=3 сделок в течение 5 сек)
-        cluster_details = []
-        processed_indices = set()
-        for i in range(len(self.large_trades)):
-            if i in processed_indices:
-                continue
-            current_trade_time = datetime.fromisoformat(self.large_trades[i]['TRADETIME'])
-            cluster_trades = [self.large_trades[i]]
-            cluster_indices = {i}
-
-            for j in range(i + 1, len(self.large_trades)):
-                next_trade_time = datetime.fromisoformat(self.large_trades[j]['TRADETIME'])
-                if (next_trade_time - current_trade_time).total_seconds() <= 5:
-                    cluster_trades.append(self.large_trades[j])
-                    cluster_indices.add(j)
-                else:
-                    break
-            
-            if len(cluster_trades) >= 3:
-                cluster_details.append({
-                    'count': len(cluster_trades),
-                    'start_time': datetime.fromisoformat(cluster_trades[0]['TRADETIME']).strftime('%H:%M:%S'),
-                    'end_time': datetime.fromisoformat(cluster_trades[-1]['TRADETIME']).strftime('%H:%M:%S'),
-                    'total_volume': sum(t['QUANTITY'] for t in cluster_trades)
-                })
-                processed_indices.update(cluster_indices)
-        
-        if cluster_details:
-            total_clusters = len(cluster_details)
-            total_clustered_trades = sum(c['count'] for c in cluster_details)
-            top_clusters = sorted(cluster_details, key=lambda x: x['count'], reverse=True)[:2]
-            cluster_info = "; ".join([f"{c['count']} сделок ({self._fmt(c['total_volume'])} лотов) c {c['start_time']} до {c['end_time']}" for c in top_clusters])
-            signals.append(f"Обнаружено {total_clusters} кластеров сделок (всего {total_clustered_trades} сделок в кластерах), где проходила интенсивная активность: {cluster_info}. Это может указывать на активность маркет-мейкера, активно поддерживающего ликвидность, или группы алгоритмов.")
+        starts, ends, sizes, volumes = _find_clusters(self._times.view(np.int64), self._qty_cumsum)
+        if len(starts):
+            # Форматируем только два самых крупных кластера
+            top_clusters = np.argsort(-sizes, kind='stable')[:2]
+            cluster_info = "; ".join([
+                f"{sizes[k]} сделок ({self._fmt(volumes[k])} лотов) c {self._fmt_time(self._times[starts[k]])} до {self._fmt_time(self._times[ends[k] - 1])}"
+                for k in top_clusters
+            ])
+            signals.append(f"Обнаружено {len(starts)} кластеров сделок (всего {sizes.sum()} сделок в кластерах), где проходила интенсивная активность: {cluster_info}. Это может указывать на активность маркет-мейкера, активно поддерживающего ликвидность, или группы алгоритмов.")
 
         # 4. Частые сделки на одном уровне (POC)
-        price_counter = Counter([t['PRICE'] for t in self.large_trades])
-        frequent_price_sorted = sorted([item for item in price_counter.items() if item[1] >= 5], key=lambda x: x[1], reverse=True)[:3]
+        frequent_price_sorted = self._most_frequent(self._price, source=[t['PRICE'] for t in self.large_trades])
         if frequent_price_sorted:
             price_details = "; ".join([f"цена {p} ({count} раз)" for p, count in frequent_price_sorted])
             signals.append(f"Обнаружены частые сделки по одной цене: {price_details} — это может быть признаком того, что маркет-мейкер защищает или удерживает данный ценовой уровень.")
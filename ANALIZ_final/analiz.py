@@ -2,9 +2,28 @@ import pandas as pd
 import numpy as np
 import json
 import os
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # orjson не установлен — используем стандартный json
+    orjson = None
+    _json_loads = json.loads
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow не установлен — Parquet читается целиком через доступный движок pandas
+    pq = None
+
+try:
+    import zstandard as zstd
+except ImportError:  # zstandard не установлен — отчеты с расширением .zst недоступны
+    zstd = None
+
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -18,33 +37,68 @@ class TickerAnalyzer:
             raise ValueError("DataFrame пуст или имеет неверный формат.")
         self.df = self._preprocess_data(trades_df)
         self.ticker = self.df['SECID'].iloc[0] if not self.df.empty else 'Unknown'
+        # Числовые столбцы извлекаются в массивы NumPy один раз — расчеты работают с ними без накладных расходов pandas
+        self._price = self.df['PRICE'].to_numpy()
+        self._qty = self.df['QUANTITY'].to_numpy()
+        self._value = self.df['VALUE'].to_numpy()
+        self._signed_volume = self.df['signed_volume'].to_numpy()
+        # Кэш квантилей VALUE по всей сессии: {квантиль: порог}
+        self._value_quantiles = {}
         logging.info(f"Инициализирован анализатор для {self.ticker} с {len(self.df)} сделками.")
 
     def _preprocess_data(self, df: pd.DataFrame) -> pd.DataFrame:
         """Подготовка данных: конвертация типов, создание нужных столбцов."""
-        df = df.copy()
-        df['TRADETIME'] = pd.to_datetime(df['TRADEDATE'] + ' ' + df['TRADETIME'], errors='coerce')
+        # Поверхностная копия: ниже столбцы только переприсваиваются, поэтому входной DataFrame
+        # не меняется, а данные всех столбцов не дублируются в памяти
+        df = df.copy(deep=False)
+        # Формат MOEX известен заранее: явный format избавляет pandas от угадывания формата
+        df['TRADETIME'] = pd.to_datetime(df['TRADEDATE'].astype(str) + ' ' + df['TRADETIME'].astype(str),
+                                         format='%Y-%m-%d %H:%M:%S', errors='coerce')
         df.dropna(subset=['TRADETIME'], inplace=True)
 
+        # Из JSON числа обычно приходят уже числовыми — тогда повторная конвертация не нужна
         for col in ['PRICE', 'QUANTITY']:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
+            if not pd.api.types.is_numeric_dtype(df[col]):
+                df[col] = pd.to_numeric(df[col], errors='coerce')
 
         # Для фьючерсов и некоторых акций нет поля VALUE, создаем его
         # Это не всегда реальный объем в рублях, но позволяет сравнивать сделки
         if 'VALUE' not in df.columns:
             df['VALUE'] = df['PRICE'] * df['QUANTITY']
-        else:
+        elif not pd.api.types.is_numeric_dtype(df['VALUE']):
             df['VALUE'] = pd.to_numeric(df['VALUE'], errors='coerce')
 
-        # Создаем "подписанный объем": положительный для покупок, отрицательный для продаж
-        try:
-            df['signed_volume'] = df['QUANTITY'] * np.where(df['BUYSELL'] == 'B', 1, -1)
-        except Exception as e:
-            logging.warning(f"Не удалось рассчитать 'signed_volume': {e}")
-            df['signed_volume'] = 0
-
-        df = df.sort_values('TRADETIME').reset_index(drop=True)
-        return df.dropna(subset=['PRICE', 'QUANTITY', 'VALUE'])
+        # Строки без цены или объема не участвуют в анализе — отбрасываем их до расчетов
+        df = df.dropna(subset=['PRICE', 'QUANTITY', 'VALUE'])
+
+        # Объём в лотах хранится в int32, если помещается без потерь: проходы cumsum/bincount читают вдвое меньше памяти.
+        # PRICE и VALUE остаются float64 — во float32 цены MOEX теряют знаки
+        quantity = df['QUANTITY']
+        if (pd.api.types.is_integer_dtype(quantity) and not quantity.empty
+                and np.iinfo(np.int32).min <= quantity.min() and quantity.max() <= np.iinfo(np.int32).max):
+            df['QUANTITY'] = quantity.astype(np.int32)
+
+        # Создаем "подписанный объем": положительный для покупок, отрицательный для продаж.
+        # BUYSELL хранится как категория: сравнения идут по целочисленным кодам, а не по строкам
+        df['BUYSELL'] = df['BUYSELL'].astype('category')
+        signed_volume = df['QUANTITY'].to_numpy().astype(np.int64)
+        np.negative(signed_volume, out=signed_volume, where=(df['BUYSELL'] != 'B').to_numpy())
+        df['signed_volume'] = signed_volume
+
+        # Сделки MOEX обычно уже упорядочены по времени — сортируем, только если порядок нарушен.
+        # Устойчивая сортировка сохраняет исходный порядок сделок внутри одной секунды
+        if not df['TRADETIME'].is_monotonic_increasing:
+            df = df.sort_values('TRADETIME', kind='mergesort')
+        # TRADETIME становится индексом один раз (столбец сохраняется для выгрузки сделок):
+        # resample и границы периода используют готовый отсортированный индекс
+        return df.set_index('TRADETIME', drop=False)
+
+    def _value_quantile(self, quantile: float) -> float:
+        """Квантиль VALUE по всей сессии; считается один раз для каждого значения quantile."""
+        if quantile not in self._value_quantiles:
+            # np.quantile использует выборку (partition) вместо полной сортировки, интерполяция та же, что у pandas
+            self._value_quantiles[quantile] = float(np.quantile(self._value, quantile))
+        return self._value_quantiles[quantile]
 
     def get_order_flow_metrics(self, resample_period: str = '1Min') -> pd.DataFrame:
         """Расчет дельты и кумулятивной дельты."""
@@ -52,7 +106,7 @@ class TickerAnalyzer:
             return pd.DataFrame(columns=['delta', 'cumulative_delta'])
 
         logging.info(f"Расчет метрик потока ордеров с периодом {resample_period}...")
-        delta_df = self.df.set_index('TRADETIME')['signed_volume'].resample(resample_period).sum().to_frame(name='delta')
+        delta_df = self.df['signed_volume'].resample(resample_period).sum().to_frame(name='delta')
         delta_df['cumulative_delta'] = delta_df['delta'].cumsum()
         return delta_df
 
@@ -62,14 +116,17 @@ class TickerAnalyzer:
             return pd.DataFrame(columns=['TRADETIME', 'PRICE', 'vwap'])
 
         logging.info("Расчет VWAP...")
-        q = self.df['QUANTITY'].values
-        p = self.df['PRICE'].values
+        q = self._qty
+        p = self._price
 
-        # Для предотвращения деления на ноль, если объем равен 0 в начале
-        cumulative_q = q.cumsum()
-        vwap = np.divide((p * q).cumsum(), cumulative_q, out=np.zeros_like(cumulative_q, dtype=float), where=cumulative_q!=0)
+        # Накопленный оборот считается в одном буфере: произведение, cumsum и деление выполняются на месте
+        vwap = np.multiply(p, q, dtype=np.float64)
+        np.cumsum(vwap, out=vwap)
+        cumulative_q = np.cumsum(q, dtype=np.float64)
+        # Для предотвращения деления на ноль, если объем равен 0 в начале (там и оборот равен 0)
+        np.divide(vwap, cumulative_q, out=vwap, where=cumulative_q != 0)
 
-        vwap_df = self.df[['TRADETIME', 'PRICE']].copy()
+        vwap_df = self.df[['TRADETIME', 'PRICE']].copy(deep=False)
         vwap_df['vwap'] = vwap
         return vwap_df
 
@@ -79,22 +136,29 @@ class TickerAnalyzer:
             return {'volume_profile': [], 'poc_level': None, 'poc_volume': 0}
 
         logging.info(f"Расчет профиля объема с {bins} уровнями...")
+        # pd.cut задаёт границы и подписи интервалов, а объём по уровням суммируется
+        # через np.bincount по кодам категорий — без groupby по объектам Interval
         price_bins = pd.cut(self.df['PRICE'], bins=bins)
-        volume_profile = self.df.groupby(price_bins)['QUANTITY'].sum().sort_index()
-
-        if volume_profile.empty:
+        codes = price_bins.cat.codes.to_numpy()
+        intervals = price_bins.cat.categories
+        qty = self._qty
+        valid = codes >= 0
+        # Суммы по уровням накапливаются в int64, даже если сам объём хранится в int32
+        volume_dtype = np.int64 if np.issubdtype(qty.dtype, np.integer) else qty.dtype
+        volumes = np.bincount(codes[valid], weights=qty[valid], minlength=len(intervals)).astype(volume_dtype)
+        if not valid.any():
             return {'volume_profile': [], 'poc_level': None, 'poc_volume': 0}
 
-        poc_interval = volume_profile.idxmax()
+        poc_idx = volumes.argmax()
+        poc_interval = intervals[poc_idx]
         poc_level = f"{poc_interval.left:.2f} - {poc_interval.right:.2f}"
-        poc_volume = volume_profile.max()
+        poc_volume = volumes[poc_idx]
 
-        # Конвертация для JSON-сериализации
-        volume_profile_str = volume_profile.reset_index()
-        volume_profile_str['PRICE'] = volume_profile_str['PRICE'].astype(str)
+        # Конвертация для JSON-сериализации; в профиль попадают все bins уровней, включая уровни без сделок
+        volume_profile_records = [{'PRICE': str(interval), 'QUANTITY': volume.item()} for interval, volume in zip(intervals, volumes)]
 
         return {
-            'volume_profile': volume_profile_str.to_dict('records'),
+            'volume_profile': volume_profile_records,
             'poc_level': poc_level,
             'poc_volume': float(poc_volume)
         }
@@ -105,10 +169,54 @@ class TickerAnalyzer:
             return pd.DataFrame()
 
         logging.info(f"Поиск крупных сделок (выше {quantile:.0%} квантиля)...")
-        large_trade_threshold = self.df['VALUE'].quantile(quantile)
+        large_trade_threshold = self._value_quantile(quantile)
         large_trades = self.df[self.df['VALUE'] >= large_trade_threshold]
         return large_trades[['TRADETIME', 'PRICE', 'QUANTITY', 'VALUE', 'BUYSELL']]
 
+    def get_hourly_stats(self, quantile: float = 0.95) -> list[dict]:
+        """
+        Почасовой мини-анализ: объемы покупок/продаж, дельта и число крупных сделок (VALUE выше
+        квантиля своего часа). Все часы считаются за один проход NumPy: суммы — через np.bincount
+        по номеру часа, квантили — по одной сортировке (час, VALUE) вместо groupby с transform по группам.
+        """
+        hours = self.df.index.hour.to_numpy()
+        is_buy = (self.df['BUYSELL'] == 'B').to_numpy()
+        is_sell = (self.df['BUYSELL'] == 'S').to_numpy()
+        qty = self._qty.astype(np.float64)
+        value = self._value
+
+        counts = np.bincount(hours, minlength=24)
+        buy_vol = np.bincount(hours, weights=np.where(is_buy, qty, 0), minlength=24)
+        sell_vol = np.bincount(hours, weights=np.where(is_sell, qty, 0), minlength=24)
+
+        # Квантиль с линейной интерполяцией, как в groupby().quantile(): значения часа упорядочены
+        # по возрастанию, порог — val + (next_val - val) * frac между соседними позициями
+        sorted_value = value[np.lexsort((value, hours))]
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        present = np.flatnonzero(counts)
+        q_idx = quantile * (counts[present] - 1).astype(np.float64)
+        lo = starts[present] + q_idx.astype(np.int64)
+        frac = np.mod(q_idx, 1.0)
+        hi = np.where(frac == 0.0, lo, lo + 1)
+        thresholds = np.zeros(24)
+        thresholds[present] = np.where(frac == 0.0, sorted_value[lo],
+                                       sorted_value[lo] + (sorted_value[hi] - sorted_value[lo]) * frac)
+        big_trades = np.bincount(hours[value > thresholds[hours]], minlength=24)
+
+        hourly_stats = []
+        for hour in present:
+            delta = buy_vol[hour] - sell_vol[hour]
+            direction = 'Покупатели' if delta > 0 else 'Продавцы' if delta < 0 else 'Баланс'
+            hourly_stats.append({
+                'hour': f"{hour:02d}:00–{hour+1:02d}:00",
+                'direction': direction,
+                'delta': int(delta),
+                'big_trades': int(big_trades[hour]),
+                'buy_vol': int(buy_vol[hour]),
+                'sell_vol': int(sell_vol[hour])
+            })
+        return hourly_stats
+
     def run_full_analysis(self) -> dict:
         """Запуск всех методов анализа и формирование итогового отчета."""
         logging.info(f"Запуск полного анализа для {self.ticker}...")
@@ -118,37 +226,24 @@ class TickerAnalyzer:
         vwap_df = self.get_vwap()
 
         # Почасовой мини-анализ
-        hourly_stats = []
-        if not self.df.empty:
-            self.df['hour'] = self.df['TRADETIME'].dt.hour
-            for hour, group in self.df.groupby('hour'):
-                buy_vol = group[group['BUYSELL'] == 'B']['QUANTITY'].sum()
-                sell_vol = group[group['BUYSELL'] == 'S']['QUANTITY'].sum()
-                delta = buy_vol - sell_vol
-                big_trades = group[group['VALUE'] > group['VALUE'].quantile(0.95)]
-                direction = 'Покупатели' if delta > 0 else 'Продавцы' if delta < 0 else 'Баланс'
-                hourly_stats.append({
-                    'hour': f"{hour:02d}:00–{hour+1:02d}:00",
-                    'direction': direction,
-                    'delta': int(delta),
-                    'big_trades': int(len(big_trades)),
-                    'buy_vol': int(buy_vol),
-                    'sell_vol': int(sell_vol)
-                })
+        hourly_stats = self.get_hourly_stats() if not self.df.empty else []
+
+        # Объёмы покупок и продаж за один проход groupby по категориальному BUYSELL
+        buy_sell_sums = self.df.groupby('BUYSELL', observed=True)['QUANTITY'].sum()
 
         analysis_summary = {
             'ticker': self.ticker,
             'analysis_date': datetime.now().isoformat(),
             'data_period': {
-                'start': self.df['TRADETIME'].min().isoformat() if not self.df.empty else None,
-                'end': self.df['TRADETIME'].max().isoformat() if not self.df.empty else None,
+                'start': self.df.index[0].isoformat() if not self.df.empty else None,
+                'end': self.df.index[-1].isoformat() if not self.df.empty else None,
             },
             'summary_stats': {
                 'total_trades': len(self.df),
-                'total_volume': float(self.df['QUANTITY'].sum()),
-                'buy_volume': float(self.df[self.df['BUYSELL'] == 'B']['QUANTITY'].sum()),
-                'sell_volume': float(self.df[self.df['BUYSELL'] == 'S']['QUANTITY'].sum()),
-                'delta': float(self.df['signed_volume'].sum()),
+                'total_volume': float(self._qty.sum(dtype=np.float64)),
+                'buy_volume': float(buy_sell_sums.get('B', 0)),
+                'sell_volume': float(buy_sell_sums.get('S', 0)),
+                'delta': float(self._signed_volume.sum()),
                 'poc': volume_profile_data['poc_level'],
                 'final_vwap': vwap_df['vwap'].iloc[-1] if not vwap_df.empty else None,
             },
@@ -160,8 +255,14 @@ class TickerAnalyzer:
         logging.info(f"Анализ для {self.ticker} завершен.")
         return analysis_summary
 
+# Форматы файлов со сделками: JSON от MOEX ISS и Parquet (MOEXDataCollector с trades_format='parquet')
+TRADE_FILE_EXTENSIONS = ('.json', '.parquet')
+
+# Столбцы сделок, которые использует анализ (TRADENO — для удаления дубликатов); остальные поля ISS не читаются из Parquet
+TRADE_COLUMNS = ('TRADENO', 'TRADEDATE', 'TRADETIME', 'SECID', 'PRICE', 'QUANTITY', 'VALUE', 'BUYSELL')
+
 def load_trade_files_from_folder(folder_path: str) -> list[str]:
-    """Находит все JSON-файлы со сделками в папке и возвращает список путей к ним."""
+    """Находит все файлы со сделками (JSON или Parquet) в папке и возвращает список путей к ним."""
     if not os.path.isdir(folder_path):
         logging.error(f"Указанный путь не является папкой: {folder_path}")
         return []
@@ -169,56 +270,161 @@ def load_trade_files_from_folder(folder_path: str) -> list[str]:
     file_paths = []
     for root, _, files in os.walk(folder_path):
         for filename in sorted(files):
-            if filename.endswith('.json'):
+            if filename.endswith(TRADE_FILE_EXTENSIONS):
                 file_paths.append(os.path.join(root, filename))
 
     if not file_paths:
-        logging.warning(f"В папке {folder_path} и ее подпапках не найдено JSON-файлов.")
+        logging.warning(f"В папке {folder_path} и ее подпапках не найдено файлов со сделками.")
 
     return file_paths
 
-def load_trades_from_file(file_path: str) -> pd.DataFrame | None:
-    """Загружает сделки из одного JSON-файла в DataFrame."""
+def _read_trades_payload(file_path: str) -> dict | None:
+    """Читает JSON-файл со сделками и возвращает блок 'trades' (columns/data) или None."""
     if not os.path.isfile(file_path):
         logging.error(f"Файл не найден: {file_path}")
         return None
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # Пропускаем пустые файлы (которые содержат null)
-            if data is None or 'trades' not in data or 'data' not in data['trades']:
-                logging.warning(f"Файл {file_path} пуст или имеет неверный формат. Пропускаем.")
-                return None
-
-            trades_df = pd.DataFrame(data['trades']['data'], columns=data['trades']['columns'])
-            # Удаляем дубликаты
-            if 'TRADENO' in trades_df.columns:
-                trades_df = trades_df.drop_duplicates(subset=['TRADENO'])
-            else:
-                trades_df = trades_df.drop_duplicates(subset=['TRADETIME', 'PRICE', 'QUANTITY', 'BUYSELL'])
-            return trades_df
+        with open(file_path, 'rb') as f:
+            data = _json_loads(f.read())
     except json.JSONDecodeError:
         logging.error(f"Ошибка декодирования JSON в файле {file_path}. Пропускаем.")
+        return None
     except Exception as e:
         logging.error(f"Ошибка при обработке файла {file_path}: {e}")
         return None
+    # Пропускаем пустые файлы (которые содержат null)
+    if data is None or 'trades' not in data or 'data' not in data['trades']:
+        logging.warning(f"Файл {file_path} пуст или имеет неверный формат. Пропускаем.")
+        return None
+    return data['trades']
 
-def load_trades_from_files(file_paths: list[str]) -> pd.DataFrame | None:
-    """Загружает сделки из нескольких JSON-файлов в один DataFrame."""
-    all_trades = []
-    for file_path in file_paths:
-        df = load_trades_from_file(file_path)
-        if df is not None:
-            all_trades.append(df)
-    if not all_trades:
+def _read_trades_parquet(file_path: str) -> pd.DataFrame | None:
+    """Читает сделки из Parquet-файла в DataFrame или возвращает None при ошибке."""
+    try:
+        if pq is None:
+            return pd.read_parquet(file_path)
+        # Parquet хранится по столбцам: читаются и распаковываются только нужные анализу.
+        # Набор столбцов у акций и фьючерсов разный (например, VALUE), поэтому сверяемся со схемой файла
+        available = set(pq.read_schema(file_path).names)
+        return pd.read_parquet(file_path, columns=[col for col in TRADE_COLUMNS if col in available])
+    except Exception as e:
+        logging.error(f"Ошибка при чтении Parquet-файла {file_path}: {e}")
         return None
-    df = pd.concat(all_trades, ignore_index=True)
-    # Удаляем дубликаты
+
+def _read_trades_source(file_path: str) -> dict | pd.DataFrame | None:
+    """Читает файл сделок: Parquet — сразу в DataFrame, JSON — в блок 'trades' (columns/data)."""
+    if file_path.endswith('.parquet'):
+        return _read_trades_parquet(file_path)
+    return _read_trades_payload(file_path)
+
+def _drop_duplicate_trades(df: pd.DataFrame) -> pd.DataFrame:
+    """Удаляет дубликаты сделок: по TRADENO, а при его отсутствии — по набору полей сделки."""
     if 'TRADENO' in df.columns:
-        df = df.drop_duplicates(subset=['TRADENO'])
+        return df.drop_duplicates(subset=['TRADENO'])
+    return df.drop_duplicates(subset=['TRADETIME', 'PRICE', 'QUANTITY', 'BUYSELL'])
+
+def load_trades_from_file(file_path: str) -> pd.DataFrame | None:
+    """Загружает сделки из одного файла (JSON или Parquet) в DataFrame."""
+    if file_path.endswith('.parquet'):
+        trades_df = _read_trades_parquet(file_path)
+        return _drop_duplicate_trades(trades_df) if trades_df is not None else None
+    trades = _read_trades_payload(file_path)
+    if trades is None:
+        return None
+    try:
+        return _drop_duplicate_trades(pd.DataFrame(trades['data'], columns=trades['columns']))
+    except Exception as e:
+        logging.error(f"Ошибка при обработке файла {file_path}: {e}")
+        return None
+
+def load_trades_from_files(file_paths: list[str]) -> pd.DataFrame | None:
+    """Загружает сделки из нескольких файлов (JSON или Parquet) в один DataFrame."""
+    # Строки сделок копим в списках и строим DataFrame один раз, без промежуточных таблиц на каждый файл.
+    # Файлы акций и фьючерсов различаются набором колонок, поэтому строки группируются по колонкам.
+    # Чтение и разбор файлов идут в пуле потоков: ввод-вывод отпускает GIL; map сохраняет порядок файлов
+    with ThreadPoolExecutor(max_workers=max(1, min(32, (os.cpu_count() or 1) * 4, len(file_paths)))) as executor:
+        payloads = list(executor.map(_read_trades_source, file_paths))
+    rows_by_columns = {}
+    parquet_frames = []
+    for file_path, trades in zip(file_paths, payloads):
+        if isinstance(trades, pd.DataFrame):
+            # Parquet уже прочитан в колоночном виде — строки не пересобираем
+            parquet_frames.append(trades)
+        elif trades is not None:
+            # Ширину строк проверяем по файлу: один испорченный файл пропускается, а не срывает всю загрузку
+            width = len(trades['columns'])
+            if any(len(row) != width for row in trades['data']):
+                logging.error(f"Ошибка при обработке файла {file_path}: число значений в строках не совпадает с {width} колонками")
+                continue
+            rows_by_columns.setdefault(tuple(trades['columns']), []).extend(trades['data'])
+    frames = [pd.DataFrame(rows, columns=list(columns)) for columns, rows in rows_by_columns.items()] + parquet_frames
+    if not frames:
+        return None
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    return _drop_duplicate_trades(df)
+
+# Флаги файла для write_bytes_atomic; O_BINARY (только Windows) отключает перевод строк на уровне ОС
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+
+def write_bytes_atomic(output_filename: str, payload: bytes) -> None:
+    """
+    Записывает payload во временный файл рядом с целевым и подменяет его через os.replace:
+    при обрыве процесса на диске остается либо старый файл, либо полностью записанный новый.
+    Данные уже закодированы в байты, поэтому пишутся напрямую через os.write, без буфера файлового
+    объекта Python: для небольшого отчета это один системный вызов и никаких промежуточных копий.
+    """
+    tmp_filename = output_filename + '.tmp'
+    try:
+        fd = os.open(tmp_filename, _WRITE_FLAGS, 0o644)
+        try:
+            # os.write может записать меньше запрошенного — дописываем остаток без копирования payload
+            view = memoryview(payload)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+        os.replace(tmp_filename, output_filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+def write_report_json(report: dict, output_filename: str, default=str, indent: bool = True) -> None:
+    """
+    Сохраняет отчет анализа в JSON (через orjson, если он установлен).
+    default — сериализатор для Timestamp и прочих нестандартных объектов (по умолчанию str).
+    indent=False — компактная запись без отступов для файлов, которые читают только программы.
+    Если имя файла оканчивается на .zst, JSON сжимается zstd (требует zstandard).
+    """
+    if orjson is not None:
+        # numpy-скаляры orjson сериализует сам, остальное — через default
+        option = orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if indent else 0)
+        payload = orjson.dumps(report, option=option, default=default)
+    elif indent:
+        payload = json.dumps(report, ensure_ascii=False, indent=4, default=default).encode('utf-8')
     else:
-        df = df.drop_duplicates(subset=['TRADETIME', 'PRICE', 'QUANTITY', 'BUYSELL'])
-    return df
+        payload = json.dumps(report, ensure_ascii=False, separators=(',', ':'), default=default).encode('utf-8')
+    if output_filename.endswith('.zst'):
+        if zstd is None:
+            raise ImportError("Для сжатых отчетов (.zst) требуется пакет zstandard")
+        # Уровень 3 сжимает JSON в несколько раз быстрее, чем он кодируется, — запись не замедляется
+        payload = zstd.ZstdCompressor(level=3).compress(payload)
+    write_bytes_atomic(output_filename, payload)
+
+def _analyze_one(args: tuple) -> str | None:
+    """Анализирует один тикер и сохраняет отчет в JSON. Возвращает путь к файлу или None при ошибке."""
+    ticker, ticker_df, out_dir = args
+    logging.info(f"\n--- Начинается анализ для тикера: {ticker} ---")
+    try:
+        analyzer = TickerAnalyzer(ticker_df)
+        report = analyzer.run_full_analysis()
+        output_filename = os.path.join(out_dir, f'analysis_{ticker}.json')
+        write_report_json(report, output_filename)
+        logging.info(f"Анализ для {ticker} завершен. Отчет сохранен в: {output_filename}")
+        return output_filename
+    except Exception as e:
+        logging.error(f"Критическая ошибка при анализе тикера {ticker}: {e}", exc_info=True)
+        return None
 
 if __name__ == '__main__':
     mode = input("Анализировать (1) папку, (2) один файл, (3) несколько файлов? [1/2/3]: ").strip()
@@ -241,21 +447,14 @@ if __name__ == '__main__':
         full_df = None
 
     if full_df is not None and not full_df.empty:
-        # Анализ по каждому тикеру в данных
-        for ticker in full_df['SECID'].unique():
-            logging.info(f"\n--- Начинается анализ для тикера: {ticker} ---")
-            ticker_df = full_df[full_df['SECID'] == ticker].copy()
-            try:
-                analyzer = TickerAnalyzer(ticker_df)
-                report = analyzer.run_full_analysis()
-                today = datetime.now().strftime('%Y-%m-%d')
-                dated_folder = os.path.join('analysis_results', today)
-                os.makedirs(dated_folder, exist_ok=True)
-                output_filename = os.path.join(dated_folder, f'analysis_{ticker}.json')
-                with open(output_filename, 'w', encoding='utf-8') as f:
-                    json.dump(report, f, ensure_ascii=False, indent=4, default=str)
-                logging.info(f"Анализ для {ticker} завершен. Отчет сохранен в: {output_filename}")
-            except Exception as e:
-                logging.error(f"Критическая ошибка при анализе тикера {ticker}: {e}", exc_info=True)
+        today = datetime.now().strftime('%Y-%m-%d')
+        dated_folder = os.path.join('analysis_results', today)
+        os.makedirs(dated_folder, exist_ok=True)
+        # Тикеры независимы друг от друга — анализируем их параллельно в отдельных процессах
+        # Один проход groupby вместо отдельной фильтрации всего DataFrame под каждый тикер
+        tasks = [(ticker, ticker_df, dated_folder) for ticker, ticker_df in full_df.groupby('SECID', sort=False)]
+        with multiprocessing.Pool(processes=max(1, min(os.cpu_count() or 1, len(tasks)))) as pool:
+            for _ in pool.imap_unordered(_analyze_one, tasks):
+                pass
     else:
         print("Не найдено данных для анализа.")
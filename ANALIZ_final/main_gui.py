@@ -4,20 +4,46 @@ from PyQt5.QtWidgets import (
     QPushButton, QFileDialog, QTextEdit, QLineEdit, QMessageBox,
     QProgressBar, QHBoxLayout, QCompleter
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtCore import Qt, QThread, QTimer, QStringListModel, pyqtSignal
 from moexparser2 import MOEXDataCollector
-from analiz import (
-    TickerAnalyzer, 
-    load_trade_files_from_folder, 
-    load_trades_from_file, 
-    load_trades_from_files
-)
-from plot_report import plot_report
-from report_generator import ReportGenerator
+# analiz, plot_report и report_generator (вместе с matplotlib) импортируются при первом использовании:
+# окно показывается, не дожидаясь загрузки модулей анализа
 import json
 import os
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-import pandas as pd
+
+def json_serializer(obj):
+    """Преобразует Timestamp и другие объекты в строку для JSON."""
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError(f"Объект типа {type(obj)} не сериализуем")
+
+def analyze_ticker(ticker, ticker_df, serializer):
+    """Анализирует один тикер и сохраняет отчет в JSON. Выполняется в отдельном процессе, возвращает имя файла."""
+    from analiz import TickerAnalyzer, write_report_json
+    analyzer = TickerAnalyzer(ticker_df)
+    report = analyzer.run_full_analysis()
+    output_filename = f'analysis_{ticker}.json'
+    # Запись через временный файл: прерванный анализ не оставит обрезанный JSON
+    write_report_json(report, output_filename, default=serializer)
+    return output_filename
+
+def build_text_report(file):
+    """Строит текстовый отчет по JSON-файлу анализа. Выполняется в процессе пула."""
+    from report_generator import ReportGenerator
+    with open(file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    generator = ReportGenerator(data)
+    return generator.generate_full_report()
+
+def warmup_worker():
+    """Задача для прогрева пула: процесс заранее запускается и импортирует модули анализа."""
+    import analiz
+    import report_generator
+    return os.getpid()
 
 # --- Worker Threads ---
 
@@ -26,14 +52,16 @@ class SingleCollectWorker(QThread):
     finished = pyqtSignal(str)
     error = pyqtSignal(str)
 
-    def __init__(self, ticker, market_type):
+    def __init__(self, ticker, market_type, collector=None):
         super().__init__()
         self.ticker = ticker
         self.market_type = market_type
+        # Общий сборщик окна: повторно используются HTTP-сессия и ее открытые соединения
+        self.collector = collector
 
     def run(self):
         try:
-            collector = MOEXDataCollector()
+            collector = self.collector or MOEXDataCollector()
             data = collector.get_trades_data(self.ticker, self.market_type)
             if data:
                 collector.save_data(data, self.ticker, 'trades')
@@ -50,28 +78,28 @@ class AllCollectWorker(QThread):
     finished = pyqtSignal(str)
     error = pyqtSignal(str)
 
+    def __init__(self, collector=None):
+        super().__init__()
+        self.collector = collector
+
     def run(self):
         try:
-            collector = MOEXDataCollector()
+            collector = self.collector or MOEXDataCollector()
             self.log_message.emit("Получение списка инструментов...")
             instruments = collector.get_instruments_list()
             
-            all_instruments = instruments['shares'] + instruments['futures']
-            total = len(all_instruments)
+            total = len(instruments['shares']) + len(instruments['futures'])
             self.progress_update.emit(0, total)
             
+            # Инструменты загружаются параллельно; прогресс обновляется по мере готовности каждого
             num_processed = 0
-            for market_type in ['shares', 'futures']:
-                for instrument in instruments[market_type]:
-                    ticker = instrument['ticker']
-                    self.log_message.emit(f"({num_processed+1}/{total}) Сбор данных: {ticker}...")
-                    
-                    data = collector.get_trades_data(ticker, market_type)
-                    if data:
-                        collector.save_data(data, ticker, 'trades')
-                    
-                    num_processed += 1
-                    self.progress_update.emit(num_processed, total)
+            for ticker, market_type, data in collector.fetch_all_trades(instruments):
+                if data:
+                    collector.save_data(data, ticker, 'trades')
+
+                num_processed += 1
+                self.log_message.emit(f"({num_processed}/{total}) Собраны данные: {ticker}")
+                self.progress_update.emit(num_processed, total)
             
             self.finished.emit("✔ Данные по всем инструментам собраны.")
         except Exception as e:
@@ -83,48 +111,85 @@ class AnalysisWorker(QThread):
     finished = pyqtSignal(str)
     error = pyqtSignal(str)
     log = pyqtSignal(str)
-    def __init__(self, full_df, json_serializer):
+    pool_broken = pyqtSignal(object)
+    def __init__(self, full_df, json_serializer, executor=None):
         super().__init__()
         self.full_df = full_df
         self.json_serializer = json_serializer
+        # Общий (заранее прогретый) пул процессов; если не передан, пул создается на время анализа
+        self.executor = executor
+        self._futures = {}
+        self._stopped = False
+    def stop(self):
+        """Отменяет еще не начатые задачи анализа; поток завершится после уже выполняющихся."""
+        self._stopped = True
+        for future in list(self._futures):
+            future.cancel()
     def run(self):
         try:
             import json
             import pandas as pd
-            tickers = [t for t in self.full_df['SECID'].unique() if pd.notna(t) and t]
-            self.progress.emit(0, len(tickers))
-            for i, ticker in enumerate(tickers):
-                ticker_df = self.full_df[self.full_df['SECID'] == ticker].copy()
-                analyzer = TickerAnalyzer(ticker_df)
-                report = analyzer.run_full_analysis()
-                report_str = json.dumps(report, indent=4, default=self.json_serializer)
-                output_filename = f'analysis_{ticker}.json'
-                with open(output_filename, 'w', encoding='utf-8') as f:
-                    f.write(report_str)
-                self.log.emit(f"Анализ для {ticker} сохранен в {output_filename}")
-                self.progress.emit(i+1, len(tickers))
+            # Один проход groupby вместо фильтрации всего DataFrame под каждый тикер (NaN-тикеры groupby отбрасывает сам)
+            groups = [(ticker, ticker_df) for ticker, ticker_df in self.full_df.groupby('SECID', sort=False) if ticker]
+            self.progress.emit(0, len(groups))
+            if groups:
+                if self.executor is not None:
+                    self._analyze_groups(self.executor, groups)
+                else:
+                    with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, len(groups))) as executor:
+                        self._analyze_groups(executor, groups)
             self.finished.emit("Анализ завершен!")
+        except BrokenProcessPool as e:
+            # Процесс пула аварийно завершился (например, по нехватке памяти) — окно пересоздаст пул
+            self.pool_broken.emit(self.executor)
+            if not self._stopped:
+                self.error.emit(f"процесс анализа аварийно завершился ({e}); пул процессов перезапущен, повторите анализ")
         except Exception as e:
-            self.error.emit(str(e))
+            if not self._stopped:
+                self.error.emit(str(e))
+    def _analyze_groups(self, executor, groups):
+        # Тикеры независимы — анализируем их в пуле процессов, поток только ждет результаты
+        self._futures = futures = {
+            executor.submit(analyze_ticker, ticker, ticker_df, self.json_serializer): ticker
+            for ticker, ticker_df in groups
+        }
+        for i, future in enumerate(as_completed(futures)):
+            output_filename = future.result()
+            self.log.emit(f"Анализ для {futures[future]} сохранен в {output_filename}")
+            self.progress.emit(i+1, len(groups))
 
 # --- Новый: Worker для отчёта ---
 class ReportWorker(QThread):
     finished = pyqtSignal(str)
     error = pyqtSignal(str)
-    def __init__(self, file):
+    pool_broken = pyqtSignal(object)
+    def __init__(self, file, executor=None):
         super().__init__()
         self.file = file
+        # Пул процессов: генерация отчета не конкурирует с GUI-потоком за GIL
+        self.executor = executor
+        self._future = None
+        self._stopped = False
+    def stop(self):
+        """Отменяет генерацию отчета, если она еще не начата."""
+        self._stopped = True
+        if self._future is not None:
+            self._future.cancel()
     def run(self):
         try:
-            import json
-            from report_generator import ReportGenerator
-            with open(self.file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            generator = ReportGenerator(data)
-            report = generator.generate_full_report()
+            if self.executor is not None:
+                self._future = self.executor.submit(build_text_report, self.file)
+                report = self._future.result()
+            else:
+                report = build_text_report(self.file)
             self.finished.emit(report)
+        except BrokenProcessPool as e:
+            self.pool_broken.emit(self.executor)
+            if not self._stopped:
+                self.error.emit(f"процесс пула аварийно завершился ({e}); пул процессов перезапущен, повторите попытку")
         except Exception as e:
-            self.error.emit(str(e))
+            if not self._stopped:
+                self.error.emit(str(e))
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -132,6 +197,25 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("MOEX Analyzer")
         self.setGeometry(100, 100, 900, 700)
         self.collect_thread = None
+        self.analysis_thread = None
+        self.report_thread = None
+        # Один сборщик на всё окно: его requests.Session держит пул соединений с MOEX между запросами
+        self.collector = MOEXDataCollector()
+
+        # Буфер строк лога: сообщения воркеров копятся и выводятся пачкой раз в 100 мс,
+        # чтобы QTextEdit не перестраивал документ на каждой строке
+        self._log_buffers = {}
+        self._log_timer = QTimer(self)
+        self._log_timer.setSingleShot(True)
+        self._log_timer.setInterval(100)
+        self._log_timer.timeout.connect(self._flush_logs)
+
+        # Пул процессов для анализа создается при старте и прогревается в фоне: пока пользователь
+        # выбирает данные, процессы запускаются и импортируют pandas и модули анализа
+        self.analysis_workers = os.cpu_count() or 1
+        self.analysis_pool = self._create_pool(self.analysis_workers)
+        # Отдельный процесс для текстовых отчетов: в общей очереди пула анализа отчет ждал бы все тикеры
+        self.report_pool = self._create_pool(1)
 
         # Создаем вкладки
         self.tabs = QTabWidget()
@@ -174,6 +258,13 @@ class MainWindow(QMainWindow):
         self.btn_collect_selected = QPushButton("Собрать данные по выбранному тикеру")
         self.ticker_input = QLineEdit()
         self.ticker_input.setPlaceholderText("Введите тикер или название для поиска...")
+
+        # Автодополнение создается один раз; при загрузке инструментов обновляется только список строк модели
+        self.completer_model = QStringListModel(self)
+        self.completer = QCompleter(self.completer_model, self)
+        self.completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.completer.setFilterMode(Qt.MatchContains) # Поиск по содержанию
+        self.ticker_input.setCompleter(self.completer)
         self.log_output = QTextEdit()
         self.log_output.setReadOnly(True)
 
@@ -259,26 +350,18 @@ class MainWindow(QMainWindow):
         self.log_output.append("Загрузка списка инструментов...")
         QApplication.processEvents()  # Обновляем интерфейс
 
-        collector = MOEXDataCollector()
-        instruments = collector.get_instruments_list()
+        instruments = self.collector.get_instruments_frames()
         
         self.ticker_type_map = {}
         instrument_list_for_completer = []
 
-        for share in instruments['shares']:
-            item_text = f"{share['ticker']} ({share['name']})"
-            instrument_list_for_completer.append(item_text)
-            self.ticker_type_map[share['ticker']] = 'shares'
-        for future in instruments['futures']:
-            item_text = f"{future['ticker']} ({future['name']})"
-            instrument_list_for_completer.append(item_text)
-            self.ticker_type_map[future['ticker']] = 'futures'
-
-        # Настраиваем автодополнение
-        completer = QCompleter(instrument_list_for_completer, self)
-        completer.setCaseSensitivity(Qt.CaseInsensitive)
-        completer.setFilterMode(Qt.MatchContains) # Поиск по содержанию
-        self.ticker_input.setCompleter(completer)
+        # Строки автодополнения и карта тикеров строятся по колонкам, без словаря на каждый инструмент
+        for market_type, frame in instruments.items():
+            instrument_list_for_completer.extend(f"{ticker} ({name})" for ticker, name in zip(frame['ticker'], frame['name']))
+            self.ticker_type_map.update(zip(frame['ticker'], repeat(market_type)))
+
+        # Обновляем автодополнение
+        self.completer_model.setStringList(instrument_list_for_completer)
 
         self.log_output.append("✔ Список инструментов загружен.")
 
@@ -288,8 +371,8 @@ class MainWindow(QMainWindow):
         self.progress_bar.setVisible(True)
         self.log_output.setText("Начало сбора данных по всем инструментам...")
 
-        self.collect_thread = AllCollectWorker()
-        self.collect_thread.log_message.connect(self.log_output.append)
+        self.collect_thread = AllCollectWorker(self.collector)
+        self.collect_thread.log_message.connect(lambda message: self._buffer_log(self.log_output, message))
         self.collect_thread.progress_update.connect(lambda v, m: (self.progress_bar.setMaximum(m), self.progress_bar.setValue(v)))
         self.collect_thread.finished.connect(self.on_collect_finished)
         self.collect_thread.error.connect(self.on_collect_error)
@@ -314,7 +397,7 @@ class MainWindow(QMainWindow):
         self.progress_bar.setVisible(True)
         self.log_output.append(f"Сбор данных для {ticker} ({'Фьючерс' if market_type == 'futures' else 'Акция'})...")
 
-        self.collect_thread = SingleCollectWorker(ticker, market_type)
+        self.collect_thread = SingleCollectWorker(ticker, market_type, self.collector)
         self.collect_thread.finished.connect(self.on_collect_finished)
         self.collect_thread.error.connect(self.on_collect_error)
         self.collect_thread.start()
@@ -329,7 +412,7 @@ class MainWindow(QMainWindow):
                 del self.data_files  # чтобы не было конфликта выбора
 
     def select_data_files(self):
-        files, _ = QFileDialog.getOpenFileNames(self, "Выберите один или несколько JSON-файлов", "", "JSON Files (*.json)")
+        files, _ = QFileDialog.getOpenFileNames(self, "Выберите один или несколько файлов со сделками", "", "Trade Files (*.json *.parquet)")
         if files:
             self.analysis_output.append(f"Выбраны файлы: {', '.join(files)}")
             self.data_files = files
@@ -337,6 +420,7 @@ class MainWindow(QMainWindow):
                 del self.data_folder  # чтобы не было конфликта выбора
 
     def run_analysis(self):
+        from analiz import load_trade_files_from_folder, load_trades_from_file, load_trades_from_files
         # Определяем источник данных
         full_df = None
         if hasattr(self, 'data_files'):
@@ -361,32 +445,78 @@ class MainWindow(QMainWindow):
         self.analysis_progress.setVisible(True)
         self.analysis_progress.setMaximum(0)
         self.analysis_output.append("Запуск анализа...")
-        QApplication.processEvents()
+        self.btn_run_analysis.setEnabled(False)
+
+        # Анализ идет в отдельном потоке с прогретым пулом процессов; GUI обновляется через сигналы
+        self.analysis_thread = AnalysisWorker(full_df, self.json_serializer, self.analysis_pool)
+        self.analysis_thread.pool_broken.connect(self.on_pool_broken)
+        self.analysis_thread.log.connect(lambda message: self._buffer_log(self.analysis_output, message))
+        self.analysis_thread.progress.connect(lambda v, m: (self.analysis_progress.setMaximum(m), self.analysis_progress.setValue(v)))
+        self.analysis_thread.finished.connect(self.on_analysis_finished)
+        self.analysis_thread.error.connect(self.on_analysis_error)
+        self.analysis_thread.start()
+
+    def _buffer_log(self, output, message):
+        """Добавляет строку в буфер лога виджета output; вывод произойдет при ближайшем срабатывании таймера."""
+        self._log_buffers.setdefault(output, []).append(message)
+        if not self._log_timer.isActive():
+            self._log_timer.start()
+
+    def _flush_logs(self):
+        """Выводит накопленные строки лога одним вызовом append на виджет."""
+        self._log_timer.stop()
+        for output, lines in self._log_buffers.items():
+            if lines:
+                output.append('\n'.join(lines))
+                lines.clear()
+
+    def on_analysis_finished(self, message):
+        """Слот, вызываемый по завершении анализа."""
+        self._flush_logs()
+        self.analysis_progress.setVisible(False)
+        self.btn_run_analysis.setEnabled(True)
+        self.analysis_thread = None
+        QMessageBox.information(self, "Готово", message)
 
-        try:
-            tickers = [t for t in full_df['SECID'].unique() if pd.notna(t) and t]
-            self.analysis_progress.setMaximum(len(tickers))
-
-            for i, ticker in enumerate(tickers):
-                ticker_df = full_df[full_df['SECID'] == ticker].copy()
-                analyzer = TickerAnalyzer(ticker_df)
-                report = analyzer.run_full_analysis()
-                report_str = json.dumps(report, indent=4, default=self.json_serializer)
-                output_filename = f'analysis_{ticker}.json'
-                with open(output_filename, 'w', encoding='utf-8') as f:
-                    f.write(report_str)
-                self.analysis_output.append(f"Анализ для {ticker} сохранен в {output_filename}")
-                self.analysis_progress.setValue(i + 1)
-                QApplication.processEvents()
-
-            QMessageBox.information(self, "Готово", "Анализ завершен!")
-        except Exception as e:
-            QMessageBox.critical(self, "Ошибка", f"Ошибка при анализе: {str(e)}")
-        finally:
-            self.analysis_progress.setVisible(False)
+    def on_analysis_error(self, message):
+        """Слот, вызываемый при ошибке анализа."""
+        self._flush_logs()
+        self.analysis_progress.setVisible(False)
+        self.btn_run_analysis.setEnabled(True)
+        self.analysis_thread = None
+        QMessageBox.critical(self, "Ошибка", f"Ошибка при анализе: {message}")
+
+    def _create_pool(self, workers):
+        """Создает пул процессов и прогревает его в фоне задачами warmup_worker."""
+        pool = ProcessPoolExecutor(max_workers=workers)
+        for _ in range(workers):
+            pool.submit(warmup_worker)
+        return pool
+
+    def on_pool_broken(self, pool):
+        """Слот: пул с аварийно завершившимся процессом больше не принимает задачи — создаем новый."""
+        if pool is self.analysis_pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.analysis_pool = self._create_pool(self.analysis_workers)
+        elif pool is self.report_pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self.report_pool = self._create_pool(1)
+
+    def closeEvent(self, event):
+        """Останавливает потоки анализа и отчета, затем пулы процессов при закрытии окна."""
+        # Потоки ждут future.result(): сначала отменяем их задачи и дожидаемся выхода,
+        # иначе остановленный пул оставит поток висеть на ожидании результата
+        for thread in (self.analysis_thread, self.report_thread):
+            if thread is not None and thread.isRunning():
+                thread.stop()
+                thread.wait()
+        self.analysis_pool.shutdown(wait=False, cancel_futures=True)
+        self.report_pool.shutdown(wait=False, cancel_futures=True)
+        super().closeEvent(event)
 
     def on_collect_finished(self, message):
         """Слот, вызываемый по завершении сбора данных."""
+        self._flush_logs()
         self.log_output.append(message)
         if self.progress_bar.maximum() != 0:
             self.progress_bar.setValue(self.progress_bar.maximum())
@@ -397,20 +527,19 @@ class MainWindow(QMainWindow):
 
     def on_collect_error(self, message):
         """Слот, вызываемый при ошибке сбора данных."""
+        self._flush_logs()
         self.log_output.append(f"❌ {message}")
         QMessageBox.critical(self, "Ошибка", message)
         self.set_data_collection_enabled(True)
         self.progress_bar.setVisible(False)
         self.collect_thread = None
 
-    def json_serializer(self, obj):
-        """Преобразует Timestamp и другие объекты в строку для JSON."""
-        if hasattr(obj, 'isoformat'):
-            return obj.isoformat()
-        raise TypeError(f"Объект типа {type(obj)} не сериализуем")
+    # Сериализатор — функция модуля, чтобы его можно было передать в процессы пула
+    json_serializer = staticmethod(json_serializer)
 
     # ===== Методы для вкладки графиков =====
     def plot_selected_json(self):
+        from plot_report import plot_report
         file, _ = QFileDialog.getOpenFileName(self, "Выберите JSON файл", "", "JSON Files (*.json)")
         if file:
             self.plot_output.append("Построение графика...")
@@ -426,7 +555,8 @@ class MainWindow(QMainWindow):
         file, _ = QFileDialog.getOpenFileName(self, "Выберите JSON файл", "", "JSON Files (*.json)")
         if file:
             self.report_output.setPlainText("Генерация отчёта...")
-            self.report_thread = ReportWorker(file)
+            self.report_thread = ReportWorker(file, self.report_pool)
+            self.report_thread.pool_broken.connect(self.on_pool_broken)
             self.report_thread.finished.connect(lambda report: (self.report_output.setPlainText(report), QMessageBox.information(self, "Готово", "Отчет сгенерирован!")))
             self.report_thread.error.connect(lambda msg: QMessageBox.critical(self, "Ошибка", f"Ошибка при генерации отчета: {msg}"))
             self.report_thread.start()
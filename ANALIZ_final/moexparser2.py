@@ -1,11 +1,23 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import io
 import json
+import pandas as pd
 import schedule
 import time
 from datetime import datetime, timedelta
 import os
 import logging
 from threading import Thread
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:  # orjson не установлен — используем стандартный json
+    orjson = None
+    _json_loads = json.loads
 
 # Настройка логирования
 logging.basicConfig(
@@ -18,81 +30,149 @@ logging.basicConfig(
 )
 
 class MOEXDataCollector:
-    def __init__(self, data_folder="moex_data"):
+    # Адреса ISS собираются из шаблонов: для тикера базовый URL строится один раз, страницы отличаются только start
+    SHARES_URL = "https://iss.moex.com/iss/engines/stock/markets/shares/boards/TQBR/securities.json?iss.meta=off&iss.only=securities&securities.columns=SECID,SHORTNAME"
+    FUTURES_URL = "https://iss.moex.com/iss/engines/futures/markets/forts/securities.json?iss.meta=off&iss.only=securities&securities.columns=SECID,SECNAME,MATDATE"
+    TRADES_URL_TEMPLATES = {
+        'shares': 'https://iss.moex.com/iss/engines/stock/markets/shares/boards/TQBR/securities/{ticker}/trades.json?start=',
+        'futures': 'https://iss.moex.com/iss/engines/futures/markets/forts/securities/{ticker}/trades.json?start='
+    }
+    # Сколько страниц сделок одного инструмента запрашивается параллельно
+    PAGE_WORKERS = 4
+
+    def __init__(self, data_folder="moex_data", trades_format="json", max_connections=32):
         self.data_dir = data_folder
+        # Формат файлов со сделками: 'json' (по умолчанию) или 'parquet' (колоночный, требует pyarrow)
+        self.trades_format = trades_format
         os.makedirs(os.path.join(self.data_dir, 'trades', 'shares'), exist_ok=True)
         os.makedirs(os.path.join(self.data_dir, 'trades', 'futures'), exist_ok=True)
         self.session = requests.Session()
-        self.session.headers.update({'User-Agent': 'MOEX Data Collector/1.0'})
+        # Ответы ISS — JSON-текст, хорошо сжимаемый: явно запрашиваем сжатие и держим соединения открытыми
+        self.session.headers.update({
+            'User-Agent': 'MOEX Data Collector/1.0',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive'
+        })
+        # Таймауты (подключение, чтение), чтобы зависшее соединение не занимало поток пула бесконечно
+        self.timeout = (10, 30)
+        # Пул соединений рассчитан на параллельную загрузку: max_connections должен покрывать число
+        # одновременных запросов (потоки fetch_all_trades × PAGE_WORKERS), иначе лишние соединения
+        # открываются заново и закрываются после запроса. Повтор запроса при перегрузке или сбое сервера
+        adapter = HTTPAdapter(
+            pool_connections=max_connections,
+            pool_maxsize=max_connections,
+            max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=(429, 500, 502, 503, 504))
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
 
-    def get_instruments_list(self):
-        """Получение списка всех инструментов с MOEX"""
-        instruments = {'shares': [], 'futures': []}
+    def _get_securities_frame(self, url, columns):
+        """Загрузка таблицы securities с MOEX в DataFrame с заданными именами колонок."""
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        # Байты ответа разбираются напрямую, без промежуточной строки; dtype=object сохраняет значения как есть (None остаётся None)
+        return pd.DataFrame(_json_loads(response.content)['securities']['data'], columns=columns, dtype=object)
 
+    def _write_atomic(self, filename, payload):
+        """Запись байтов через временный файл и os.replace: прерванная запись не портит уже сохраненный файл."""
+        tmp_filename = filename + '.tmp'
         try:
-            # Акции (TQBR)
-            shares_url = "https://iss.moex.com/iss/engines/stock/markets/shares/boards/TQBR/securities.json?iss.meta=off&securities.columns=SECID,SHORTNAME"
-            response = self.session.get(shares_url)
-            response.raise_for_status()
-            data = response.json()
+            # Буфер 2 МиБ вместо стандартных 8 КиБ — файлы сделок занимают мегабайты
+            with open(tmp_filename, 'wb', buffering=2 * 1024 * 1024) as f:
+                f.write(payload)
+            os.replace(tmp_filename, filename)
+        except BaseException:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
 
-            instruments['shares'] = [
-                {'ticker': item[0], 'name': item[1]}
-                for item in data['securities']['data']
-                if len(item) >= 2
-            ]
+    def get_instruments_frames(self):
+        """
+        Получение списка всех инструментов с MOEX в колоночном виде:
+        {'shares': DataFrame[ticker, name], 'futures': DataFrame[ticker, name, expiration]}.
+        """
+        try:
+            # Запрашивается только блок securities с нужными колонками: marketdata и прочие блоки не передаются и не разбираются
+            # Акции (TQBR)
+            shares = self._get_securities_frame(self.SHARES_URL, ['ticker', 'name'])
 
             # Фьючерсы (FORTS)
-            futures_url = "https://iss.moex.com/iss/engines/futures/markets/forts/securities.json?iss.meta=off&securities.columns=SECID,SECNAME,MATDATE"
-            response = self.session.get(futures_url)
-            response.raise_for_status()
-            data = response.json()
-
-            instruments['futures'] = [
-                {'ticker': item[0], 'name': item[1], 'expiration': item[2] if len(item) > 2 else None}
-                for item in data['securities']['data']
-                if len(item) >= 1
-            ]
+            futures = self._get_securities_frame(self.FUTURES_URL, ['ticker', 'name', 'expiration'])
 
-            logging.info(f"Получено {len(instruments['shares'])} акций и {len(instruments['futures'])} фьючерсов")
+            logging.info(f"Получено {len(shares)} акций и {len(futures)} фьючерсов")
 
         except Exception as e:
             logging.error(f"Ошибка при загрузке списка инструментов: {e}")
-            # Возвращаем пустой список в случае ошибки
-            return {'shares': [], 'futures': []}
+            # Возвращаем пустые таблицы в случае ошибки
+            return {
+                'shares': pd.DataFrame(columns=['ticker', 'name'], dtype=object),
+                'futures': pd.DataFrame(columns=['ticker', 'name', 'expiration'], dtype=object)
+            }
+
+        return {'shares': shares, 'futures': futures}
+
+    def get_instruments_list(self):
+        """Получение списка всех инструментов с MOEX в виде списков словарей по рынкам"""
+        return {market_type: frame.to_dict('records') for market_type, frame in self.get_instruments_frames().items()}
+
+    def _trades_base_url(self, ticker, market_type):
+        """Адрес сделок инструмента без значения start (всё, что не акции, запрашивается на FORTS)."""
+        template = self.TRADES_URL_TEMPLATES['shares' if market_type == 'shares' else 'futures']
+        return template.format(ticker=ticker)
 
-        return instruments
+    def _get_trades_page(self, base_url, start):
+        """Загрузка одной страницы сделок, начиная с позиции start."""
+        response = self.session.get(f'{base_url}{start}', timeout=self.timeout)
+        response.raise_for_status()
+        # Разбираем сырые байты ответа напрямую (orjson, если установлен), без декодирования в str
+        return _json_loads(response.content)
 
-    def get_trades_data(self, ticker, market_type='shares'):
-        """Получение всех данных о сделках для конкретного инструмента за день (с пагинацией)."""
+    def get_trades_data(self, ticker, market_type='shares', page_workers=PAGE_WORKERS):
+        """
+        Получение всех данных о сделках для конкретного инструмента за день (с пагинацией).
+        После первой полной страницы следующие page_workers страниц запрашиваются параллельно.
+        """
+        base_url = self._trades_base_url(ticker, market_type)
         all_data = None
+        # Строки сделок всех страниц копятся в одном списке — это список первой страницы внутри all_data
+        rows = None
         start = 0
         page_size = 1000
-        while True:
-            try:
-                if market_type == 'shares':
-                    url = f'https://iss.moex.com/iss/engines/stock/markets/shares/boards/TQBR/securities/{ticker}/trades.json?start={start}'
-                else:
-                    url = f'https://iss.moex.com/iss/engines/futures/markets/forts/securities/{ticker}/trades.json?start={start}'
-                response = self.session.get(url)
-                response.raise_for_status()
-                data = response.json()
-                # Проверяем, есть ли данные
-                trades = data.get('trades', {})
-                if not trades or not trades.get('data'):
+        with ThreadPoolExecutor(max_workers=page_workers) as executor:
+            while True:
+                # Первая страница запрашивается отдельно: у большинства инструментов она единственная
+                starts = [start] if all_data is None else [start + i * page_size for i in range(page_workers)]
+                futures = [executor.submit(self._get_trades_page, base_url, page_start) for page_start in starts]
+                last_page = False
+                # Страницы обрабатываются строго по порядку, чтобы сделки шли в исходной последовательности
+                for future in futures:
+                    try:
+                        data = future.result()
+                    except Exception as e:
+                        logging.error(f'Ошибка при получении данных по сделкам для {ticker}: {e}')
+                        last_page = True
+                        break
+                    # Проверяем, есть ли данные
+                    trades = data.get('trades', {})
+                    if not trades or not trades.get('data'):
+                        last_page = True
+                        break
+                    if all_data is None:
+                        all_data = data
+                        rows = trades['data']
+                    else:
+                        # Добавляем новые сделки к уже собранным
+                        rows.extend(trades['data'])
+                    # Если получено меньше page_size, значит это последняя страница
+                    if len(trades['data']) < page_size:
+                        last_page = True
+                        break
+                if last_page:
+                    # Запросы за пределами последней страницы больше не нужны
+                    for future in futures:
+                        future.cancel()
                     break
-                if all_data is None:
-                    all_data = data
-                else:
-                    # Добавляем новые сделки к уже собранным
-                    all_data['trades']['data'].extend(trades['data'])
-                # Если получено меньше page_size, значит это последняя страница
-                if len(trades['data']) < page_size:
-                    break
-                start += page_size
-            except Exception as e:
-                logging.error(f'Ошибка при получении данных по сделкам для {ticker}: {e}')
-                break
+                start = starts[-1] + page_size
         return all_data
 
     def save_data(self, data, ticker, data_type, market_type='shares'):
@@ -109,31 +189,51 @@ class MOEXDataCollector:
         filename = os.path.join(market_folder, f"{ticker}_{data_type}_{today}.json")
 
         try:
-            with open(filename, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=4)
+            if data_type == 'trades' and self.trades_format == 'parquet':
+                # Таблица сделок хранится колоночно со сжатием; загрузчики analiz читают её без разбора JSON
+                filename = filename[:-len('.json')] + '.parquet'
+                trades = data['trades']
+                # Сериализуем в память и пишем через _write_atomic: сбой записи не оставит .tmp-файл
+                buffer = io.BytesIO()
+                pd.DataFrame(trades['data'], columns=trades['columns']).to_parquet(buffer, compression='zstd', index=False)
+                self._write_atomic(filename, buffer.getvalue())
+            elif orjson is not None:
+                # Файлы читают только загрузчики analiz — пишем компактный JSON без отступов
+                self._write_atomic(filename, orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS))
+            else:
+                self._write_atomic(filename, json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
             logging.info(f'Данные сохранены в файл: {filename}')
         except Exception as e:
             logging.error(f'Ошибка при сохранении файла {filename}: {e}')
 
+    def fetch_all_trades(self, instruments, max_workers=8):
+        """
+        Параллельная загрузка сделок по всем инструментам в пуле потоков.
+        Генератор: по мере готовности возвращает кортежи (ticker, market_type, data).
+        """
+        # Запросы к MOEX ограничены сетью, а не CPU, — потоки перекрывают задержки ответов
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self.get_trades_data, instrument['ticker'], market_type): (instrument['ticker'], market_type)
+                for market_type in ['shares', 'futures']
+                for instrument in instruments[market_type]
+            }
+            for future in as_completed(futures):
+                ticker, market_type = futures[future]
+                yield ticker, market_type, future.result()
+
     def collect_all_data(self):
         """Сбор данных по всем инструментам"""
         logging.info("Начало сбора данных...")
         instruments = self.get_instruments_list()
 
-        for market_type in ['shares', 'futures']:
-            for instrument in instruments[market_type]:
-                ticker = instrument['ticker']
-                logging.info(f"Обрабатывается {ticker} ({market_type})...")
-
-                data = self.get_trades_data(ticker, market_type)
-                if data:
-                    self.save_data(data, ticker, 'trades', market_type)
-
-                # Добавьте здесь другие типы данных, которые нужно собирать
-                # Например, стаканы котировок, исторические данные и т.д.
+        for ticker, market_type, data in self.fetch_all_trades(instruments):
+            logging.info(f"Обработан {ticker} ({market_type})")
+            if data:
+                self.save_data(data, ticker, 'trades', market_type)
 
-                # Небольшая задержка между запросами
-                time.sleep(1)
+            # Добавьте здесь другие типы данных, которые нужно собирать
+            # Например, стаканы котировок, исторические данные и т.д.
 
         logging.info("Сбор данных завершен")
 
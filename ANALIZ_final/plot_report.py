@@ -1,100 +1,185 @@
 import json
+import matplotlib
+# Графики только сохраняются в файл: растровый бэкенд Agg задается явно, без инициализации Qt/Tk
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from datetime import datetime
+from matplotlib.collections import LineCollection
+from matplotlib.transforms import Affine2D
 import sys
 import os
-import pandas as pd
+import numpy as np
+import atexit
+import re
+# Отбор крупнейших сделок общий с текстовым отчетом (модуль без тяжелых зависимостей)
+from report_generator import top_indices_by_value
+
+try:
+    import orjson
+except ImportError:  # orjson не установлен — используем стандартный json
+    orjson = None
+
+try:
+    import zstandard as zstd
+except ImportError:  # zstandard не установлен — сжатые отчеты (.zst) не читаются
+    zstd = None
 
 # --- Настройки ---
 plt.style.use('seaborn-v0_8-darkgrid')
 
 # --- Функция для форматирования чисел с пробелами ---
 def fmt_num(val):
-    try:
-        return f"{int(val):,}".replace(",", " ")
-    except Exception:
-        return str(val)
+    # Значения приходят из JSON уже числами, поэтому обработка исключений не нужна
+    return format(int(val), ',').replace(',', ' ')
+
+# Доля длины выноски от сделки до центра подписи: подпись из трех строк (fontsize 6) занимает ~±11 пт по вертикали
+LEADER_FRACTION = 0.8
+
+# Нижняя граница POC из строки вида "299.41 - 299.44" (или одно число)
+_POC_RE = re.compile(r'^\s*(\d+(?:\.\d*)?)\s*(?:-|$)')
+
+# --- Удаление дубликатов сделок ---
+def drop_duplicate_trades(large_trades):
+    """
+    Удаляет повторы сделок одним проходом по списку, сохраняя первое вхождение и исходный порядок.
+    Ключ — TRADENO, если он есть, иначе (TRADETIME, PRICE, QUANTITY, BUYSELL).
+    """
+    if len(large_trades) < 2:
+        return large_trades
+    if 'TRADENO' in large_trades[0]:
+        key = lambda t: t['TRADENO']
+    else:
+        key = lambda t: (t['TRADETIME'], t['PRICE'], t['QUANTITY'], t['BUYSELL'])
+    seen = set()
+    unique_trades = []
+    for t in large_trades:
+        k = key(t)
+        if k not in seen:
+            seen.add(k)
+            unique_trades.append(t)
+    return unique_trades
+
+# --- Общая фигура для пакетного построения ---
+# Figure (вместе с холстом бэкенда) создается один раз на процесс и очищается перед каждым графиком:
+# при построении графиков по сотням тикеров фигура не создается и не уничтожается заново
+_FIG = None
+
+def _get_figure():
+    """Возвращает общую фигуру с новой парой осей (цена, объём)."""
+    global _FIG
+    if _FIG is None:
+        _FIG = plt.figure(figsize=(14, 7))
+        atexit.register(plt.close, _FIG)
+    else:
+        # Оси пересоздаются, а не очищаются через cla(): у осей twinx после cla() остаются
+        # пределы прошлого графика и подписи переезжают налево
+        _FIG.clear()
+        # tight_layout зависит от исходного положения осей — начинаем с тех же полей, что у новой фигуры
+        _FIG.subplots_adjust(**{side: plt.rcParams[f'figure.subplot.{side}'] for side in ('left', 'bottom', 'right', 'top', 'wspace', 'hspace')})
+    ax1 = _FIG.add_subplot()
+    return _FIG, (ax1, ax1.twinx())
 
 # --- Загрузка данных ---
 def load_analysis(json_path):
-    with open(json_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(json_path, 'rb') as f:
+        payload = f.read()
+    if json_path.endswith('.zst'):
+        # Сжатый отчет (analysis_*.json.zst): после распаковки разбирается как обычный JSON
+        if zstd is None:
+            raise ImportError("Для чтения сжатых отчетов (.zst) требуется пакет zstandard")
+        payload = zstd.ZstdDecompressor().decompress(payload)
+    if orjson is not None:
+        # orjson разбирает байты файла напрямую, заметно быстрее json на больших списках сделок
+        try:
+            return orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            # Отчеты, записанные стандартным json, могут содержать NaN/Infinity, которые orjson не принимает
+            return json.loads(payload)
+    return json.loads(payload)
 
 # --- Основная функция построения графика ---
-def plot_report(json_path, output_folder=None):
-    data = load_analysis(json_path)
+def plot_report(json_path, output_folder=None, data=None):
+    # data — уже разобранный JSON анализа (например, тот же словарь, что передается в ReportGenerator):
+    # тогда файл json_path повторно не читается
+    if data is None:
+        data = load_analysis(json_path)
     ticker = data.get('ticker', 'TICKER')
     large_trades = data.get('large_trades', [])
     # Удаляем дубликаты сделок
-    if large_trades:
-        df_trades = pd.DataFrame(large_trades)
-        if 'TRADENO' in df_trades.columns:
-            df_trades = df_trades.drop_duplicates(subset=['TRADENO'])
-        else:
-            df_trades = df_trades.drop_duplicates(subset=['TRADETIME', 'PRICE', 'QUANTITY', 'BUYSELL'])
-        large_trades = df_trades.to_dict('records')
+    large_trades = drop_duplicate_trades(large_trades)
     stats = data.get('summary_stats', {})
     vwap = stats.get('final_vwap')
     poc = stats.get('poc')
 
     # --- Подготовка данных ---
-    times = [datetime.fromisoformat(t['TRADETIME']) for t in large_trades]
-    prices = [t['PRICE'] for t in large_trades]
-    volumes = [t['QUANTITY'] for t in large_trades]
-    values = [t['VALUE'] for t in large_trades]
+    # Столбцы сделок собираются в массивы NumPy: время разбирается C-парсером datetime64, а не по одной строке
+    n = len(large_trades)
+    times = np.array([t['TRADETIME'] for t in large_trades], dtype='datetime64[ns]')
+    prices = np.fromiter((t['PRICE'] for t in large_trades), dtype=np.float64, count=n)
+    volumes = np.fromiter((t['QUANTITY'] for t in large_trades), dtype=np.float64, count=n)
+    values = np.fromiter((t['VALUE'] for t in large_trades), dtype=np.float64, count=n)
 
     # Определяем топ-10 самых крупных сделок по сумме
     top_n = 10
-    top_indices = sorted(range(len(large_trades)), key=lambda i: large_trades[i]['VALUE'], reverse=True)[:top_n]
-    buys = [i for i in top_indices if large_trades[i]['BUYSELL'] == 'B']
-    sells = [i for i in top_indices if large_trades[i]['BUYSELL'] == 'S']
+    top_indices = top_indices_by_value(values, top_n)
+    top_sides = np.array([large_trades[i]['BUYSELL'] for i in top_indices])
+    buys = top_indices[top_sides == 'B']
+    sells = top_indices[top_sides == 'S']
 
     # --- Готовим отображение номеров сделок по времени ---
     # Сортируем top_indices по времени сделки
-    top_indices_sorted_by_time = sorted(top_indices, key=lambda i: large_trades[i]['TRADETIME'])
+    top_indices_sorted_by_time = top_indices[np.argsort(times[top_indices], kind='stable')]
     index_to_time_rank = {i: rank+1 for rank, i in enumerate(top_indices_sorted_by_time)}
 
     # --- График ---
-    fig, ax1 = plt.subplots(figsize=(14, 7))
-    ax2 = ax1.twinx()
+    fig, (ax1, ax2) = _get_figure()
 
     # Цена (по крупным сделкам)
     ax1.plot(times, prices, label='Цена (крупные сделки)', color='tab:blue', linewidth=2)
 
-    # Объёмы (столбики)
-    ax2.bar(times, volumes, width=0.0005, alpha=0.3, color='tab:gray', label='Объём (лоты)')
+    # Объёмы (вертикальные линии): одна LineCollection вместо отдельного прямоугольника на каждую сделку
+    ax2.vlines(times, 0, volumes, colors='tab:gray', alpha=0.3, linewidth=1, label='Объём (лоты)')
 
     # Маркеры только для топ-10 крупных покупок/продаж
-    ax1.scatter([times[i] for i in buys], [prices[i] for i in buys], s=80, color='green', marker='^', label='Крупные покупки (топ-10)')
-    ax1.scatter([times[i] for i in sells], [prices[i] for i in sells], s=80, color='red', marker='v', label='Крупные продажи (топ-10)')
-
-    # Подписи ко всем стрелкам (топ-10)
+    ax1.scatter(times[buys], prices[buys], s=80, color='green', marker='^', label='Крупные покупки (топ-10)')
+    ax1.scatter(times[sells], prices[sells], s=80, color='red', marker='v', label='Крупные продажи (топ-10)')
+
+    # Подписи ко всем стрелкам (топ-10): время берется из уже разобранного массива times
+    top_hhmm = [s[11:16] for s in np.datetime_as_string(times[top_indices], unit='m')]
+    top_qty = [fmt_num(v) for v in volumes[top_indices]]
+    top_value = [fmt_num(v) for v in values[top_indices]]
+    # Увеличенное смещение подписей (в пунктах): по диагонали, чередуем направления
+    label_offsets = [(-80 if idx % 3 == 0 else (80 if idx % 3 == 1 else 0), 60 if idx % 2 == 0 else -60)
+                     for idx in range(len(top_indices))]
     for idx, i in enumerate(top_indices):
         t = large_trades[i]
-        t_time = datetime.fromisoformat(t['TRADETIME'])
-        # Увеличенное смещение: по диагонали, чередуем направления
-        y_offset = 60 if idx % 2 == 0 else -60
-        x_offset = -80 if idx % 3 == 0 else (80 if idx % 3 == 1 else 0)
         color = 'green' if t['BUYSELL'] == 'B' else 'red'
         deal_num = index_to_time_rank[i]
-        ax1.annotate(f"#{deal_num} {t['TRADETIME'][11:16]} по {t['PRICE']}\n{fmt_num(t['QUANTITY'])} лотов\n{fmt_num(t['VALUE'])} руб.",
-                     (t_time, t['PRICE']),
-                     textcoords="offset points", xytext=(x_offset, y_offset), ha='center', fontsize=6,
-                     color=color,
-                     bbox=dict(boxstyle="round,pad=0.2", fc="#ffffe0", alpha=0.18),
-                     arrowprops=dict(arrowstyle="-", color="gray", alpha=0.5, lw=1))
+        ax1.annotate(f"#{deal_num} {top_hhmm[idx]} по {t['PRICE']}\n{top_qty[idx]} лотов\n{top_value[idx]} руб.",
+                     (times[i], t['PRICE']),
+                     textcoords="offset points", xytext=label_offsets[idx], ha='center', va='center', fontsize=6,
+                     color=color)
+    # Выноски от сделок к подписям — одна LineCollection вместо стрелки-патча в каждой подписи:
+    # отрезки заданы в пунктах и привязаны к точкам сделок через offsets (как маркеры scatter),
+    # и обрываются на LEADER_FRACTION длины, не заходя на текст подписи
+    if len(top_indices):
+        leaders = LineCollection(
+            [[(0, 0), (LEADER_FRACTION * dx, LEADER_FRACTION * dy)] for dx, dy in label_offsets],
+            colors='gray', alpha=0.5, linewidths=1,
+            offsets=np.column_stack((mdates.date2num(times[top_indices]), prices[top_indices])),
+            offset_transform=ax1.transData,
+            transform=Affine2D().scale(1 / 72) + fig.dpi_scale_trans
+        )
+        ax1.add_collection(leaders, autolim=False)
 
     # Линия VWAP
     if vwap:
         ax1.axhline(vwap, color='orange', linestyle='--', linewidth=1.5, label=f'VWAP {vwap}')
     # Линия POC
     if poc:
-        try:
-            poc_level = float(str(poc).split('-')[0].strip())
-            ax1.axhline(poc_level, color='purple', linestyle=':', linewidth=1.5, label=f'POC {poc}')
-        except Exception:
-            pass
+        poc_match = _POC_RE.match(str(poc))
+        if poc_match:
+            ax1.axhline(float(poc_match.group(1)), color='purple', linestyle=':', linewidth=1.5, label=f'POC {poc}')
 
     # Оформление
     ax1.set_title(f"{ticker}: Крупные сделки, объёмы, VWAP, POC", fontsize=16)
@@ -103,9 +188,12 @@ def plot_report(json_path, output_folder=None):
     ax2.set_ylabel('Объём (лоты)')
     ax1.xaxis.set_major_formatter(mdates.DateFormatter('%H:%M'))
     fig.autofmt_xdate()
-    ax1.legend(loc='upper left')
-    ax2.legend(loc='upper right')
-    plt.tight_layout()
+    # Одна общая легенда для обеих осей; размещается на ax2, которая рисуется поверх ax1,
+    # чтобы линии объёма не перекрывали рамку легенды
+    handles1, labels1 = ax1.get_legend_handles_labels()
+    handles2, labels2 = ax2.get_legend_handles_labels()
+    ax2.legend(handles1 + handles2, labels1 + labels2, loc='upper left')
+    fig.tight_layout()
 
     # Сохранение
     if output_folder:
@@ -114,7 +202,8 @@ def plot_report(json_path, output_folder=None):
     else:
         out_path = f"plot_{ticker}.png"
 
-    plt.savefig(out_path, dpi=150)
+    # Быстрое сжатие PNG: файл немного больше, но кодирование заметно дешевле (изображение без потерь то же)
+    fig.savefig(out_path, dpi=150, pil_kwargs={'compress_level': 1})
     print(f"График сохранён: {out_path}")
 
     # Отключение авто-открытия для серверного/автоматического режима
@@ -123,7 +212,7 @@ def plot_report(json_path, output_folder=None):
     # except Exception as e:
     #     print(f"Не удалось открыть изображение автоматически: {e}")
 
-    plt.close(fig) # Закрываем фигуру, чтобы освободить память
+    # Фигура не закрывается: следующий вызов очистит и переиспользует ее (закрывается при выходе из процесса)
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
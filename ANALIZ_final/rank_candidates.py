@@ -1,90 +1,178 @@
 import os
 import re
 import logging
+import heapq
+import pickle
+from concurrent.futures import ProcessPoolExecutor
 
-class ReportAnalyzer:
+# С какого числа отчетов разбор идет в пуле процессов: на нескольких файлах запуск процессов дороже самой работы
+PARALLEL_MIN_REPORTS = 64
+
+# Кэш оценок рядом с отчетами: {имя файла: (mtime_ns, размер, запись кандидата)}.
+# Неизмененные отчеты при повторном ранжировании не читаются и не оцениваются заново
+RANK_CACHE_FILENAME = '.rank_cache.pkl'
+
+# Правила скоринга: (шаблон, баллы, основание).
+# Шаблон — либо фраза в нижнем регистре (ищется подстрокой в тексте, приведенном к нижнему регистру),
+# либо регулярное выражение, скомпилированное один раз при импорте модуля
+_LONG_RULES = (
+    ("рынок был под контролем быков", 2, "Бычий сентимент"),
+    (re.compile(r"цена закрытия .*? находится выше vwap", re.I), 1, "Цена выше VWAP"),
+    ("активный откуп на лоях", 2, "Активный откуп"),
+    ("кульминация продаж", 3, "Кульминация продаж"),
+    (re.compile(r"закол уровня poc.*?силе покупателей", re.I), 2, "Ложный пробой POC (сила покупателей)"),
+)
+_SHORT_RULES = (
+    ("медведи доминировали", 2, "Медвежий сентимент"),
+    (re.compile(r"цена закрытия .*? находится ниже vwap", re.I), 1, "Цена ниже VWAP"),
+    ("разгрузка на хаях", 2, "Разгрузка на хаях"),
+    ("кульминация покупок", 3, "Кульминация покупок"),
+    (re.compile(r"закол уровня poc.*?слабость покупателей", re.I), 2, "Ложный пробой POC (слабость покупателей)"),
+)
+
+# Подстроки, хотя бы одна из которых обязательно входит в текст, если срабатывает любое правило:
+# отчеты без них отсеиваются быстрым поиском подстроки, без прохода всех правил
+_ANY_HINT = ('быков', 'vwap', 'откуп', 'кульминация', 'poc', 'медведи', 'разгрузка')
+
+def _rules_signature() -> str:
+    """Отпечаток набора правил: кэш оценок, посчитанный по другим правилам, не используется."""
+    return repr([(getattr(pattern, 'pattern', pattern), score, reason) for pattern, score, reason in _LONG_RULES + _SHORT_RULES])
+
+def _load_rank_cache(cache_path: str) -> dict:
+    """Загружает кэш оценок; при отсутствии, повреждении или смене правил возвращает пустой."""
+    try:
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+        if cache.get('rules') == _rules_signature():
+            return cache['entries']
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f"Кэш ранжирования {cache_path} не прочитан, отчеты будут оценены заново: {e}")
+    return {}
+
+def _save_rank_cache(cache_path: str, entries: dict):
+    """Сохраняет кэш оценок; ошибка записи (например, папка только для чтения) не прерывает ранжирование."""
+    try:
+        tmp_path = cache_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'rules': _rules_signature(), 'entries': entries}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logging.warning(f"Не удалось сохранить кэш ранжирования {cache_path}: {e}")
+
+def _rule_matches(pattern, text: str, text_lower: str) -> bool:
+    """Проверяет одно правило: фразу — поиском подстроки, регулярное выражение — через search."""
+    if isinstance(pattern, str):
+        return pattern in text_lower
+    return pattern.search(text) is not None
+
+def _apply_rules(rules, text: str, text_lower: str) -> tuple[int, list]:
+    """Суммирует баллы сработавших правил и собирает их основания в порядке правил."""
+    total = 0
+    reasons = []
+    for pattern, score, reason in rules:
+        if _rule_matches(pattern, text, text_lower):
+            total += score
+            reasons.append(reason)
+    return total, reasons
+
+def score_report(report_text: str) -> tuple[int, int, list, list]:
+    """
+    Оценивает текстовый отчет по набору правил.
+    Возвращает (long_score, short_score, long_reasons, short_reasons).
     """
-    Анализирует текстовый отчет и выставляет скоринговые баллы для лонга и шорта.
+    # Текст приводится к нижнему регистру один раз — для всех правил-фраз
+    text_lower = report_text.lower()
+    if not any(hint in text_lower for hint in _ANY_HINT):
+        return 0, 0, [], []
+    long_score, long_reasons = _apply_rules(_LONG_RULES, report_text, text_lower)
+    short_score, short_reasons = _apply_rules(_SHORT_RULES, report_text, text_lower)
+    return long_score, short_score, long_reasons, short_reasons
+
+def _analyze_file(file_path: str) -> dict | None:
     """
-    def __init__(self, report_text, ticker):
-        self.text = report_text
-        self.ticker = ticker
-        self.long_score = 0
-        self.short_score = 0
-        self.long_reasons = []
-        self.short_reasons = []
-
-    def analyze(self):
-        """
-        Применяет набор правил для оценки отчета.
-        """
-        # --- Сигналы в ЛОНГ ---
-        if re.search(r"рынок был под контролем быков", self.text, re.I):
-            self.long_score += 2
-            self.long_reasons.append("Бычий сентимент")
-        if re.search(r"цена закрытия .*? находится выше vwap", self.text, re.I):
-            self.long_score += 1
-            self.long_reasons.append("Цена выше VWAP")
-        if re.search(r"активный откуп на лоях", self.text, re.I):
-            self.long_score += 2
-            self.long_reasons.append("Активный откуп")
-        if re.search(r"кульминация продаж", self.text, re.I):
-            self.long_score += 3
-            self.long_reasons.append("Кульминация продаж")
-        if re.search(r"закол уровня poc.*?силе покупателей", self.text, re.I):
-            self.long_score += 2
-            self.long_reasons.append("Ложный пробой POC (сила покупателей)")
-
-        # --- Сигналы в ШОРТ ---
-        if re.search(r"медведи доминировали", self.text, re.I):
-            self.short_score += 2
-            self.short_reasons.append("Медвежий сентимент")
-        if re.search(r"цена закрытия .*? находится ниже vwap", self.text, re.I):
-            self.short_score += 1
-            self.short_reasons.append("Цена ниже VWAP")
-        if re.search(r"разгрузка на хаях", self.text, re.I):
-            self.short_score += 2
-            self.short_reasons.append("Разгрузка на хаях")
-        if re.search(r"кульминация покупок", self.text, re.I):
-            self.short_score += 3
-            self.short_reasons.append("Кульминация покупок")
-        if re.search(r"закол уровня poc.*?слабость покупателей", self.text, re.I):
-            self.short_score += 2
-            self.short_reasons.append("Ложный пробой POC (слабость покупателей)")
-
-def rank_reports(reports_folder: str) -> tuple[list, list]:
+    Читает и оценивает один отчет. Возвращает запись кандидата или None при ошибке.
+    Функция уровня модуля, чтобы ее можно было выполнять в пуле процессов.
+    """
+    filename = os.path.basename(file_path)
+    ticker = filename.replace("report_", "").replace(".txt", "")
+    try:
+        # Файл читается одним блоком байтов и декодируется целиком, без построчного текстового слоя.
+        # Правила работают с str: re.I и lower() для кириллицы корректны только на Unicode-строках
+        with open(file_path, 'rb') as f:
+            report_text = f.read().decode('utf-8')
+
+        long_score, short_score, long_reasons, short_reasons = score_report(report_text)
+        return {
+            "ticker": ticker,
+            "long_score": long_score,
+            "short_score": short_score,
+            "long_reasons": long_reasons,
+            "short_reasons": short_reasons
+        }
+    except Exception as e:
+        logging.error(f"Не удалось проанализировать отчет {filename}: {e}")
+        return None
+
+def rank_reports(reports_folder: str, top_n: int | None = None) -> tuple[list, list]:
     """
     Читает все отчеты из папки, анализирует и возвращает отсортированные списки кандидатов.
+    Если задан top_n, в каждом списке остаются только top_n лучших (без сортировки всего списка).
     """
-    candidates = []
     logging.info(f"Анализ отчетов из папки: {reports_folder}")
     if not os.path.isdir(reports_folder):
         logging.error(f"Папка с отчетами не найдена: {reports_folder}")
         return [], []
 
-    for filename in os.listdir(reports_folder):
-        if filename.endswith(".txt"):
-            ticker = filename.replace("report_", "").replace(".txt", "")
-            file_path = os.path.join(reports_folder, filename)
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    report_text = f.read()
-
-                analyzer = ReportAnalyzer(report_text, ticker)
-                analyzer.analyze()
-                candidates.append({
-                    "ticker": ticker,
-                    "long_score": analyzer.long_score,
-                    "short_score": analyzer.short_score,
-                    "long_reasons": analyzer.long_reasons,
-                    "short_reasons": analyzer.short_reasons
-                })
-            except Exception as e:
-                logging.error(f"Не удалось проанализировать отчет {filename}: {e}")
-
-    # Сортировка кандидатов
-    long_candidates = sorted([c for c in candidates if c['long_score'] > 0], key=lambda x: x['long_score'], reverse=True)
-    short_candidates = sorted([c for c in candidates if c['short_score'] > 0], key=lambda x: x['short_score'], reverse=True)
+    with os.scandir(reports_folder) as entries:
+        # is_file() использует тип из записи каталога, без отдельного stat на файл
+        report_entries = [entry for entry in entries if entry.name.endswith(".txt") and entry.is_file()]
+
+    cache_path = os.path.join(reports_folder, RANK_CACHE_FILENAME)
+    cache = _load_rank_cache(cache_path)
+    new_cache = {}
+    results = [None] * len(report_entries)
+    missing = []
+    for pos, entry in enumerate(report_entries):
+        stat = entry.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = cache.get(entry.name)
+        if cached is not None and cached[:2] == signature:
+            results[pos] = cached[2]
+            new_cache[entry.name] = cached
+        else:
+            missing.append((pos, entry.name, signature, entry.path))
+
+    # Оцениваются только новые и измененные отчеты; map сохраняет порядок файлов, как в последовательном цикле
+    missing_paths = [file_path for _, _, _, file_path in missing]
+    if len(missing_paths) >= PARALLEL_MIN_REPORTS:
+        with ProcessPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            scored = list(executor.map(_analyze_file, missing_paths, chunksize=16))
+    else:
+        scored = [_analyze_file(file_path) for file_path in missing_paths]
+    for (pos, name, signature, _), candidate in zip(missing, scored):
+        results[pos] = candidate
+        # Отчеты с ошибкой не кэшируются — при следующем запуске будет новая попытка
+        if candidate is not None:
+            new_cache[name] = (*signature, candidate)
+
+    # Записи удаленных отчетов в кэше не сохраняются
+    if new_cache != cache:
+        _save_rank_cache(cache_path, new_cache)
+    candidates = [candidate for candidate in results if candidate is not None]
+
+    # Сортировка кандидатов; heapq.nlargest дает тот же порядок, что sorted(..., reverse=True)[:top_n], за O(N log top_n)
+    long_key = lambda x: x['long_score']
+    short_key = lambda x: x['short_score']
+    long_pool = (c for c in candidates if c['long_score'] > 0)
+    short_pool = (c for c in candidates if c['short_score'] > 0)
+    if top_n is None:
+        long_candidates = sorted(long_pool, key=long_key, reverse=True)
+        short_candidates = sorted(short_pool, key=short_key, reverse=True)
+    else:
+        long_candidates = heapq.nlargest(top_n, long_pool, key=long_key)
+        short_candidates = heapq.nlargest(top_n, short_pool, key=short_key)
 
     return long_candidates, short_candidates
 
@@ -118,7 +206,8 @@ def run_ranking(reports_folder: str):
     """
     Главная функция для запуска ранжирования.
     """
-    long_candidates, short_candidates = rank_reports(reports_folder)
+    # В сводку попадают только топ-5, поэтому полная сортировка не нужна
+    long_candidates, short_candidates = rank_reports(reports_folder, top_n=5)
     print_summary(long_candidates, short_candidates)
 
 if __name__ == '__main__':
@@ -1,13 +1,85 @@
 import json
 import os
 import logging
+from functools import cached_property
+from bisect import bisect_left, bisect_right, insort
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from typing import Iterable
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 # from collections import Counter # Удаляем, так как теперь в AlgoDetector
 from algo_detector import AlgoDetector # Импортируем новый класс
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Структура крупной сделки для ReportGenerator.lt; side: 1 — покупка, -1 — продажа, 0 — прочее
+LARGE_TRADE_DTYPE = np.dtype([('price', np.float64), ('qty', np.float64), ('value', np.float64),
+                              ('side', np.int8), ('time', 'datetime64[ns]')])
+# Поля, по которым одинаковые крупные сделки считаются повтором
+_TRADE_KEY_FIELDS = ['time', 'price', 'qty', 'side']
+_BUY = 1
+_SELL = -1
+
+# С какого числа отчетов generate_reports_parallel использует пул процессов: на нескольких отчетах
+# запуск процессов и передача данных дороже самой генерации
+PARALLEL_MIN_REPORTS = 8
+
+# Разделители секций отчета
+_SEP20 = "-"*20
+_SEP40 = "="*40
+
+# Перестановка символов 'YYYY-MM-DDTHH:MM:SS' в 'DD.MM.YYYY HH:MM:SS' (разделители дописываются отдельно)
+_TIME_STR_ORDER = [8, 9, 4, 5, 6, 4, 0, 1, 2, 3, 10, 11, 12, 13, 14, 15, 16, 17, 18]
+
+def _format_trade_times(times: np.ndarray) -> np.ndarray:
+    """
+    Форматирует массив datetime64 как строки ДД.ММ.ГГГГ ЧЧ:ММ:СС (как strftime('%d.%m.%Y %H:%M:%S')), целиком в NumPy:
+    ISO-строки из np.datetime_as_string переставляются посимвольно одной выборкой по индексам.
+    """
+    iso = np.ascontiguousarray(np.datetime_as_string(times, unit='s'), dtype='U19')
+    chars = np.ascontiguousarray(iso.view('U1').reshape(-1, 19)[:, _TIME_STR_ORDER])
+    chars[:, [2, 5]] = '.'
+    chars[:, 10] = ' '
+    return chars.view('U19').ravel()
+
+def _session_summary(deltas: np.ndarray):
+    """
+    Сводка по ряду кумулятивной дельты: (min, min_idx, max, max_idx, final).
+    Индексы — первого вхождения экстремума, как у list.index. Ряд не должен быть пустым.
+    """
+    min_idx = int(deltas.argmin())
+    max_idx = int(deltas.argmax())
+    return deltas[min_idx], min_idx, deltas[max_idx], max_idx, deltas[-1]
+
+def _order_statistic(values: np.ndarray, q: float):
+    """
+    Элемент sorted(values)[int(len(values)*q)] (для одного значения — само значение) без полной сортировки:
+    np.partition находит k-й элемент за O(N). np.quantile здесь не подходит — он интерполирует между соседями.
+    """
+    if len(values) < 2:
+        return values.max()
+    k = int(len(values)*q)
+    return np.partition(values, k)[k]
+
+def top_indices_by_value(values: np.ndarray, top_n: int) -> np.ndarray:
+    """
+    Индексы top_n наибольших значений по убыванию; при равных значениях раньше идет меньший индекс
+    (как у sorted(..., reverse=True)). Отбор — argpartition за O(N), сортируются только отобранные.
+    Используется и в plot_report для выбора крупнейших сделок на графике.
+    """
+    if len(values) > top_n:
+        candidates = np.argpartition(-values, top_n - 1)[:top_n]
+        # argpartition разбивает равные значения на границе произвольно — добираем их по порядку индексов
+        threshold = values[candidates].min()
+        above = np.flatnonzero(values > threshold)
+        at_threshold = np.flatnonzero(values == threshold)[:top_n - len(above)]
+        top = np.concatenate((above, at_threshold))
+    else:
+        top = np.arange(len(values))
+    return top[np.lexsort((top, -values[top]))]
+
 class ReportGenerator:
     """
     Генерирует текстовый трейдерский отчет по рыночной ситуации на основе JSON-файла от TickerAnalyzer.
@@ -18,10 +90,84 @@ class ReportGenerator:
         self.data = analysis_data
         self.ticker = self.data.get('ticker', 'Unknown')
         self.stats = self.data.get('summary_stats', {})
+        # POC и VWAP разбираются один раз; self.poc — значение для вывода, self.poc_level — нижняя граница POC числом
+        self.poc = self.stats.get('poc')
+        self.final_vwap = self.stats.get('final_vwap')
+        self.poc_level = None
+        if self.poc:
+            try:
+                self.poc_level = float(str(self.poc).split('-')[0].strip())
+            except ValueError:
+                pass
         self.order_flow = self.data.get('order_flow_data', [])
         self.volume_profile = self.data.get('volume_profile', [])
         self.large_trades = self.data.get('large_trades', [])
-        self.algo_detector = AlgoDetector(self.large_trades) # Инициализируем AlgoDetector
+        # Есть ли вообще крупные сделки и точки order_flow: проверяется один раз, а секции без данных
+        # сразу выводят заглушку, не строя массивы и не запуская поиски
+        self._has_trades = bool(self.large_trades)
+        self._has_flow = bool(self.order_flow)
+        # Сводка по кумулятивной дельте (_get_session_summary)
+        self._delta_summary = None
+        # Результаты _compute_trade_stats (выходы объёма, кульминация, кандидаты в уровни слабости)
+        self._trade_stats = None
+
+    # --- Производные данные: строятся при первом обращении и кэшируются в экземпляре ---
+    # Отчет из части секций не платит за массивы и детектор, которые этим секциям не нужны
+    @cached_property
+    def lt(self) -> np.ndarray:
+        """
+        Крупные сделки в виде структурированного массива NumPy: поля извлекаются из словарей один раз
+        (столбцами, без построчного присваивания), дальше все секции работают с self.lt, а не с dict.
+        TRADETIME разбирается C-парсером NumPy; словари нужны только для вывода цены как в JSON.
+        """
+        n_trades = len(self.large_trades)
+        lt = np.empty(n_trades, dtype=LARGE_TRADE_DTYPE)
+        lt['price'] = np.fromiter((t['PRICE'] for t in self.large_trades), dtype=np.float64, count=n_trades)
+        lt['qty'] = np.fromiter((t['QUANTITY'] for t in self.large_trades), dtype=np.float64, count=n_trades)
+        lt['value'] = np.fromiter((t['VALUE'] for t in self.large_trades), dtype=np.float64, count=n_trades)
+        sides = np.array([t['BUYSELL'] for t in self.large_trades], dtype='U1')
+        lt['side'] = np.where(sides == 'B', _BUY, np.where(sides == 'S', _SELL, 0))
+        lt['time'] = np.array([t['TRADETIME'] for t in self.large_trades], dtype='datetime64[ns]')
+        return lt
+
+    @cached_property
+    def _lt_time_str(self) -> np.ndarray:
+        """Время всех крупных сделок в виде для отчета; секции берут строку по индексу."""
+        return _format_trade_times(self.lt['time'])
+
+    @cached_property
+    def _of_time(self) -> np.ndarray:
+        """Время точек order_flow как datetime64."""
+        return np.array([item['TRADETIME'] for item in self.order_flow], dtype='datetime64[s]')
+
+    @cached_property
+    def _deltas(self) -> np.ndarray:
+        """Кумулятивная дельта — непрерывный float64-массив; сводка по нему считается один раз по запросу."""
+        return np.fromiter((item['cumulative_delta'] for item in self.order_flow), dtype=np.float64, count=len(self.order_flow))
+
+    @cached_property
+    def last_price(self):
+        """
+        Цена закрытия: цена последней крупной сделки, а если ее нет — нижняя граница
+        последнего интервала профиля объёма. None, если цену определить не удалось.
+        """
+        last_price = self.large_trades[-1].get('PRICE') if self._has_trades else None
+        if not last_price and self.volume_profile:
+            last_price_str = self.volume_profile[-1]['PRICE']
+            if '(' in last_price_str and ']' in last_price_str:
+                try:
+                    last_price = float(last_price_str.split(',')[0].replace('(', '').replace('[', ''))
+                except ValueError:
+                    logging.warning(f"Не удалось распарсить цену из интервала POC/VWAP: {last_price_str}")
+                    last_price = None
+            else:
+                 last_price = float(last_price_str)
+        return last_price
+
+    @cached_property
+    def algo_detector(self) -> AlgoDetector:
+        """Детектор алгоритмической торговли — нужен только секции 7."""
+        return AlgoDetector(self.large_trades)
 
     def _fmt(self, value):
         """Форматирует число с пробелами между разрядами (для лотов и рублей)."""
@@ -30,6 +176,15 @@ class ReportGenerator:
         except Exception:
             return str(value)
 
+    def _fmt_array(self, values: np.ndarray) -> list[str]:
+        """Форматирует массив чисел так же, как _fmt, но одним преобразованием столбца."""
+        # Столбец переводится в int64 (с отбрасыванием дробной части, как int()) и в Python-числа
+        # одним вызовом tolist(); в цикле остается только форматирование с разделителем разрядов
+        if np.isfinite(values).all() and (np.abs(values) < 2.0**63).all():
+            return [f"{v:,}".replace(",", " ") for v in values.astype(np.int64).tolist()]
+        # NaN/inf и числа вне int64 — через обычный _fmt
+        return [self._fmt(v) for v in values.tolist()]
+
     def _format_period(self) -> str:
         """Форматирует период анализа в привычный вид."""
         start = self.data['data_period']['start']
@@ -43,153 +198,201 @@ class ReportGenerator:
         except Exception:
             return f"Период анализа: {start} - {end}"
 
+    def _flow_time_str(self, index):
+        """Форматирует время точки order_flow как ЧЧ:ММ."""
+        return np.datetime_as_string(self._of_time[index], unit='m')[11:16]
+
+    def _get_session_summary(self):
+        """Возвращает (min, min_idx, max, max_idx, final) по кумулятивной дельте (кэшируется)."""
+        if self._delta_summary is None:
+            self._delta_summary = _session_summary(self._deltas)
+        return self._delta_summary
+
+    def _compute_trade_stats(self):
+        """
+        Один раз считает по массивам крупных сделок все, что нужно поискам выходов объёма,
+        кульминации и уровней слабости, и кэширует результат:
+        spike_idx — индексы сделок с VALUE не ниже 99.5-го квантиля,
+        culmination — текст о кульминации в конце периода или None,
+        weak_idx — индексы крупных сделок, после которых цена пошла против их направления.
+        """
+        if self._trade_stats is not None:
+            return self._trade_stats
+        stats = {'spike_idx': np.empty(0, dtype=np.intp), 'culmination': None, 'weak_idx': np.empty(0, dtype=np.intp)}
+        self._trade_stats = stats
+        if not self._has_trades:
+            return stats
+        n = len(self.large_trades)
+
+        # Выходы объёма: порог — 99.5-й квантиль VALUE как элемент упорядоченного ряда
+        values = self.lt['value']
+        threshold = _order_statistic(values, 0.995)
+        stats['spike_idx'] = np.flatnonzero(values >= threshold)
+
+        # Кульминация: объём покупок и продаж последних 10 сделок
+        last = self.lt[-10:]
+        last_buys = last['side'] == _BUY
+        last_sells = last['side'] == _SELL
+        last_qty = last['qty']
+        buy_qty = last_qty[last_buys].sum()
+        sell_qty = last_qty[last_sells].sum()
+        if np.count_nonzero(last_buys) >= 6 and buy_qty > sell_qty:
+            stats['culmination'] = 'Кульминация покупок: наблюдалась серия агрессивных маркет-ордеров на объёмах выше среднего в конце сессии, что часто предшествует развороту или коррекции вниз.'
+        elif np.count_nonzero(last_sells) >= 6 and sell_qty > buy_qty:
+            stats['culmination'] = 'Кульминация продаж: наблюдалась серия агрессивных маркет-ордеров на объёмах выше среднего в конце сессии, что может сигнализировать о возможном развороте или отскоке вверх.'
+
+        # Уровни слабости: порог крупной сделки (90-й квантиль по QUANTITY)
+        quantities = self.lt['qty']
+        threshold = _order_statistic(quantities, 0.9)
+        filtered_idx = np.flatnonzero(quantities >= threshold)
+        if len(filtered_idx) < 2:
+            return stats
+        # Экстремумы цены по следующим (до 5) крупным сделкам: скользящее окно по ряду, дополненному
+        # значениями -inf/+inf, чтобы у последних сделок окно было короче, как у среза filtered[i+1:i+6]
+        filtered = self.lt[filtered_idx]
+        prices = filtered['price']
+        pad = np.full(4, np.inf)
+        future_max = sliding_window_view(np.concatenate((prices[1:], -pad)), 5).max(axis=1)
+        future_min = sliding_window_view(np.concatenate((prices[1:], pad)), 5).min(axis=1)
+        current = filtered_idx[:-1]
+        sides = filtered['side'][:-1]
+        buyers_weak = (sides == _BUY) & (future_max < prices[:-1])
+        sellers_weak = (sides == _SELL) & (future_min > prices[:-1])
+        stats['weak_idx'] = current[buyers_weak | sellers_weak]
+        return stats
+
     def _find_weakness_levels(self):
         """Находит значимые уровни слабости покупателей или продавцов (только крупные сделки, группировка по близости)."""
         weakness = []
-        if not self.large_trades:
-            return weakness
-        # Определяем порог крупной сделки (90-й квантиль по QUANTITY)
-        quantities = [t['QUANTITY'] for t in self.large_trades]
-        if not quantities:
-            return weakness
-        threshold = sorted(quantities)[int(len(quantities)*0.9)] if len(quantities) > 1 else max(quantities)
-        filtered = [t for t in self.large_trades if t['QUANTITY'] >= threshold]
-        # Анализируем только крупные сделки
-        for i, t in enumerate(filtered[:-1]):
-            price = t['PRICE']
-            direction = t['BUYSELL']
-            lookahead = filtered[i+1:i+6]
-            if not lookahead:
-                continue
-            future_prices = [x['PRICE'] for x in lookahead]
-            try: # Добавляем форматирование времени здесь
-                trade_time_formatted = datetime.fromisoformat(t['TRADETIME']).strftime('%d.%m.%Y %H:%M:%S')
-            except ValueError:
-                trade_time_formatted = t['TRADETIME']
-
-            if direction == 'B':
-                if max(future_prices) < price:
-                    weakness.append({'price': price, 'label': 'Слабость покупателей', 'time': trade_time_formatted, 'qty': t['QUANTITY']})
-            if direction == 'S':
-                if min(future_prices) > price:
-                    weakness.append({'price': price, 'label': 'Слабость продавцов', 'time': trade_time_formatted, 'qty': t['QUANTITY']})
+        # Словари собираются только для найденных сделок, в исходном порядке
+        weak_idx = self._compute_trade_stats()['weak_idx']
+        for i, trade_time_formatted in zip(weak_idx, self._lt_time_str[weak_idx]):
+            t = self.large_trades[i]
+            label = 'Слабость покупателей' if self.lt['side'][i] == _BUY else 'Слабость продавцов'
+            weakness.append({'price': t['PRICE'], 'label': label, 'time': trade_time_formatted, 'qty': t['QUANTITY']})
         # Группировка по близости (0.05% от цены)
         grouped = []
-        for w in sorted(weakness, key=lambda x: -x['qty']):
-            if not grouped or all(abs(w['price'] - g['price'])/g['price'] > 0.0005 for g in grouped):
-                grouped.append(w)
+        if all(w['price'] > 0 for w in weakness):
+            # Уровень может оказаться ближе 0.05% только к принятым уровням из узкого диапазона цен:
+            # они ищутся бинарным поиском по отсортированным ценам, а не перебором всех принятых
+            kept_prices = []
+            for w in sorted(weakness, key=lambda x: -x['qty']):
+                price = w['price']
+                near = kept_prices[bisect_left(kept_prices, price / 1.001):bisect_right(kept_prices, price / 0.999)]
+                if all(abs(price - g)/g > 0.0005 for g in near):
+                    grouped.append(w)
+                    insort(kept_prices, price)
+        else:
+            for w in sorted(weakness, key=lambda x: -x['qty']):
+                if not grouped or all(abs(w['price'] - g['price'])/g['price'] > 0.0005 for g in grouped):
+                    grouped.append(w)
         # Оставляем топ-3 по каждой стороне
         buyers = [w for w in grouped if w['label'] == 'Слабость покупателей'][:3]
         sellers = [w for w in grouped if w['label'] == 'Слабость продавцов'][:3]
         return buyers + sellers
 
-    def _get_trade_levels_block(self):
-        """Формирует блок с торговыми уровнями и пояснениями."""
+    def _get_trade_levels_block(self) -> list[str]:
+        """Формирует строки блока с торговыми уровнями и пояснениями."""
         levels = []
         levels.append("В отчёт включены только наиболее значимые уровни слабости (по крупным сделкам и яркой реакции цены):")
-        poc = self.stats.get('poc')
+        poc = self.poc
         if poc:
             levels.append(f"POC ({poc}) — зона максимального выхода объёма, выступает как магнит для цены и отражает зону интереса крупных игроков.")
         if self.volume_profile:
             sorted_clusters = sorted(self.volume_profile, key=lambda x: x['QUANTITY'], reverse=True)[:3]
             for cl in sorted_clusters:
                 levels.append(f"Кластер {cl['PRICE']} — объём {self._fmt(cl['QUANTITY'])} лотов. Эти зоны показывают, где проходил основной торговый интерес.")
-        weakness = self._find_weakness_levels()
+        weakness = self._find_weakness_levels() if self._has_trades else []
         for w in weakness:
             levels.append(f"{w['label']} на {w['price']} (объём {self._fmt(w['qty'])} лотов, сделка в {w['time']}). В этих точках агрессия одной стороны была поглощена противоположной, что может указывать на важные разворотные уровни.")
         if levels:
             levels.append("Рассмотрите эти уровни для поиска потенциальных точек входа/выхода и оценки реакции цены на них!")
-        return '\n'.join(levels) if levels else 'Нет ярко выраженных торговых уровней.'
+        return levels if levels else ['Нет ярко выраженных торговых уровней.']
 
     def _find_volume_spike(self, quantile=0.995):
         """Находит выходы объёма (аномальные сделки по объёму)."""
-        if not self.large_trades:
-            return []
-        values = [t['VALUE'] for t in self.large_trades]
-        if not values:
+        if not self._has_trades:
             return []
-        threshold = sorted(values)[int(len(values)*quantile)] if len(values) > 1 else max(values)
-        spikes = [t for t in self.large_trades if t['VALUE'] >= threshold]
+        if quantile == 0.995:
+            spike_idx = self._compute_trade_stats()['spike_idx']
+        else:
+            values = self.lt['value']
+            threshold = _order_statistic(values, quantile)
+            spike_idx = np.flatnonzero(values >= threshold)
+        spikes = [self.large_trades[i] for i in spike_idx]
         return spikes
 
     def _find_culmination(self):
         """Находит кульминацию продаж/покупок (серии крупных сделок в одну сторону в конце периода)."""
-        if not self.large_trades:
-            return None
-        last_trades = self.large_trades[-10:]
-        buys = [t for t in last_trades if t['BUYSELL'] == 'B']
-        sells = [t for t in last_trades if t['BUYSELL'] == 'S']
-        if len(buys) >= 6 and sum(t['QUANTITY'] for t in buys) > sum(t['QUANTITY'] for t in sells):
-            return 'Кульминация покупок: наблюдалась серия агрессивных маркет-ордеров на объёмах выше среднего в конце сессии, что часто предшествует развороту или коррекции вниз.'
-        if len(sells) >= 6 and sum(t['QUANTITY'] for t in sells) > sum(t['QUANTITY'] for t in buys):
-            return 'Кульминация продаж: наблюдалась серия агрессивных маркет-ордеров на объёмах выше среднего в конце сессии, что может сигнализировать о возможном развороте или отскоке вверх.'
-        return None
+        return self._compute_trade_stats()['culmination']
 
     def _find_fake_break(self):
         """Пытается найти закол уровня (ложный пробой POC/VWAP)."""
-        poc = self.stats.get('poc')
-        vwap = self.stats.get('final_vwap')
-        if not poc or not vwap or not self.large_trades:
+        poc = self.poc
+        poc_level = self.poc_level
+        if not poc or not self.final_vwap or not self._has_trades:
             return None
-        try:
-            poc_level = float(str(poc).split('-')[0].strip())
-        except Exception:
-            poc_level = None
-        last_price = self.large_trades[-1]['PRICE'] if self.large_trades else None
+        last_price = self.large_trades[-1]['PRICE']
         if last_price and poc_level:
             # Если был пробой POC и возврат
-            prices = [t['PRICE'] for t in self.large_trades[-20:]]
-            if max(prices) > poc_level and last_price < poc_level:
+            prices = self.lt['price'][-20:]
+            if prices.max() > poc_level and last_price < poc_level:
                 return f"Закол уровня POC ({poc}): цена пробила уровень вверх, но не удержалась и вернулась под него — классический ложный пробой и ловушка для лонгистов, указывающая на слабость покупателей."
-            if min(prices) < poc_level and last_price > poc_level:
+            if prices.min() < poc_level and last_price > poc_level:
                 return f"Закол уровня POC ({poc}): цена пробила уровень вниз, но не удержалась и вернулась выше — ловушка для шортистов, сигнализирующая о силе покупателей."
         return None
 
-    def _get_top_trades_block(self, top_n=3):
-        """Формирует блок топ-сделок с трейдерскими формулировками."""
-        if not self.large_trades:
-            return "Нет крупных сделок для анализа."
+    def _get_top_trades_block(self, top_n=3) -> list[str]:
+        """Формирует строки блока топ-сделок с трейдерскими формулировками."""
+        if not self._has_trades:
+            return ["Нет крупных сделок для анализа."]
         # Уникальные сделки по времени, цене, объёму, направлению
-        seen = set()
-        unique_trades = []
-        for t in sorted(self.large_trades, key=lambda t: t['VALUE'], reverse=True):
-            key = (t['TRADETIME'], t['PRICE'], t['QUANTITY'], t['BUYSELL'])
-            if key not in seen:
-                seen.add(key)
-                unique_trades.append(t)
-            if len(unique_trades) >= top_n:
+        # Кандидаты отбираются argpartition; если среди них слишком много повторов, окно удваивается
+        # (хотя бы одна сделка выводится и при top_n=0, как раньше)
+        limit = max(top_n, 1)
+        window = limit
+        while True:
+            candidates = top_indices_by_value(self.lt['value'], window)
+            # np.unique по полям ключа возвращает индекс первого вхождения каждой сделки;
+            # после сортировки эти индексы снова идут по убыванию суммы
+            _, first_idx = np.unique(self.lt[candidates][_TRADE_KEY_FIELDS], return_index=True)
+            unique_idx = candidates[np.sort(first_idx)[:limit]]
+            if len(unique_idx) >= limit or window >= len(self.large_trades):
                 break
+            window *= 2
         lines = ["ТОП-агрессивные сделки (выходы объёма):"]
-        for t in unique_trades:
+        top = self.lt[unique_idx]
+        qty_str = self._fmt_array(top['qty'])
+        value_str = self._fmt_array(top['value'])
+        for i, time_str, qty, value in zip(unique_idx, self._lt_time_str[unique_idx], qty_str, value_str):
+            t = self.large_trades[i]
             direction = 'покупка' if t['BUYSELL'] == 'B' else 'продажа'
-            # --- форматируем время ---
-            try:
-                dt = datetime.fromisoformat(t['TRADETIME'])
-                time_str = dt.strftime('%d.%m.%Y %H:%M:%S')
-            except Exception:
-                time_str = t['TRADETIME']
-            lines.append(f"- {time_str} — {direction.upper()} на {self._fmt(t['QUANTITY'])} лотов по {t['PRICE']} (сумма {self._fmt(t['VALUE'])} рублей)")
-        return '\n'.join(lines)
+            lines.append(f"- {time_str} — {direction.upper()} на {qty} лотов по {t['PRICE']} (сумма {value} рублей)")
+        return lines
 
     # --- Новый метод: ТОП-50 сделок дня ---
-    def _get_top50_trades_block(self):
-        """Формирует блок топ-50 сделок дня и краткий вывод по ним."""
-        if not self.large_trades:
-            return "Нет крупных сделок для анализа."
-        # Сортируем по VALUE
-        top_trades = sorted(self.large_trades, key=lambda t: t['VALUE'], reverse=True)[:50]
+    def _get_top50_trades_block(self) -> list[str]:
+        """Формирует строки блока топ-50 сделок дня и краткий вывод по ним."""
+        if not self._has_trades:
+            return ["Нет крупных сделок для анализа."]
+        # Полная сортировка не нужна: argpartition отбирает 50 крупнейших за O(N), сортируются только они
+        top_idx = top_indices_by_value(self.lt['value'], 50)
+        top = self.lt[top_idx]
         lines = ["ТОП-50 сделок дня:"]
-        total_buys = sum(1 for t in top_trades if t['BUYSELL'] == 'B')
-        total_sells = sum(1 for t in top_trades if t['BUYSELL'] == 'S')
+        total_buys = int(np.count_nonzero(top['side'] == _BUY))
+        total_sells = int(np.count_nonzero(top['side'] == _SELL))
         
-        for idx, t in enumerate(top_trades, 1):
-            direction = 'покупка' if t['BUYSELL'] == 'B' else 'продажа'
-            try:
-                dt = datetime.fromisoformat(t['TRADETIME'])
-                time_str = dt.strftime('%d.%m.%Y %H:%M:%S')
-            except Exception:
-                time_str = t['TRADETIME']
-            lines.append(f"{idx:2d}. {time_str} — {direction.upper()} на {self._fmt(t['QUANTITY'])} лотов по {t['PRICE']} (сумма {self._fmt(t['VALUE'])} рублей)")
+        # Строки собираются столбцами: каждая колонка — массив строк NumPy, склейка — цепочка np.char.add;
+        # цена берется из словарей сделок, чтобы выводиться так же, как в JSON
+        idx_str = np.char.mod('%2d. ', np.arange(1, len(top_idx) + 1))
+        direction_str = np.where(top['side'] == _BUY, ' — ПОКУПКА на ', ' — ПРОДАЖА на ')
+        qty_str = np.array(self._fmt_array(top['qty']))
+        price_str = np.array([str(self.large_trades[i]['PRICE']) for i in top_idx])
+        value_str = np.array(self._fmt_array(top['value']))
+        trade_lines = np.char.add(np.char.add(idx_str, self._lt_time_str[top_idx]), np.char.add(direction_str, qty_str))
+        trade_lines = np.char.add(np.char.add(trade_lines, ' лотов по '), np.char.add(price_str, ' (сумма '))
+        trade_lines = np.char.add(np.char.add(trade_lines, value_str), ' рублей)')
+        lines.extend(trade_lines.tolist())
         
         if total_buys > total_sells:
             lines.append(f"\nОбщий характер ТОП-50 сделок: преобладали крупные ПОКУПКИ ({total_buys} шт.)")
@@ -198,7 +401,7 @@ class ReportGenerator:
         else:
             lines.append("\nОбщий характер ТОП-50 сделок: сбалансированное количество покупок и продаж.")
         
-        return '\n'.join(lines)
+        return lines
 
     # --- Новый метод: Признаки маркет-мейкера и алгоритмической торговли ---
     def _get_algo_and_mm_signals(self):
@@ -217,19 +420,8 @@ class ReportGenerator:
 
     def _get_price_vs_vwap(self) -> str:
         """Сравнивает цену закрытия с VWAP."""
-        final_vwap = self.stats.get('final_vwap')
-        poc = self.stats.get('poc')
-        last_price = self.large_trades[-1].get('PRICE') if self.large_trades else None
-        if not last_price and self.volume_profile:
-            last_price_str = self.volume_profile[-1]['PRICE']
-            if '(' in last_price_str and ']' in last_price_str:
-                try:
-                    last_price = float(last_price_str.split(',')[0].replace('(', '').replace('[', ''))
-                except ValueError:
-                    logging.warning(f"Не удалось распарсить цену из интервала POC/VWAP: {last_price_str}")
-                    last_price = None
-            else:
-                 last_price = float(last_price_str)
+        final_vwap = self.final_vwap
+        last_price = self.last_price
         if not last_price:
             return "Нет данных о цене закрытия для сравнения с VWAP."
         
@@ -244,26 +436,23 @@ class ReportGenerator:
     def _analyze_session_dynamics(self) -> list[str]:
         """Анализирует динамику сессии по кумулятивной дельте."""
         dynamics = []
-        if not self.order_flow:
+        if not self._has_flow:
             return ["Нет данных для анализа динамики сессии."]
-        
-        deltas = [item['cumulative_delta'] for item in self.order_flow]
-        if not deltas:
-            return ["Нет данных о кумулятивной дельте для анализа динамики сессии."]
+        deltas = self._deltas
         
         # 1. Общее направление с открытия
         initial_delta = deltas[0]
-        start_time = datetime.fromisoformat(self.order_flow[0]['TRADETIME']).strftime('%H:%M')
+        start_time = self._flow_time_str(0)
         if initial_delta < 0:
             dynamics.append(f"С открытия продавцы устроили медвежий захват, кумулятивная дельта резко ушла в минус ({self._fmt(initial_delta)}) — агрессивные продажи преобладали, задавая тон в начале сессии.")
         else:
             dynamics.append(f"С открытия быки взяли инициативу, кумулятивная дельта в плюсе ({self._fmt(initial_delta)}) — активные покупки задавали тон в начале сессии, оказывая давление на продавцов.")
 
         # Поиск переломных моментов
-        min_delta = min(deltas)
-        max_delta = max(deltas)
-        min_time = datetime.fromisoformat(self.order_flow[deltas.index(min_delta)]['TRADETIME']).strftime('%H:%M')
-        max_time = datetime.fromisoformat(self.order_flow[deltas.index(max_delta)]['TRADETIME']).strftime('%H:%M')
+        # Экстремумы, их индексы и финальное значение — из одной сводки по массиву дельты
+        min_delta, trough_index, max_delta, peak_index, final_delta = self._get_session_summary()
+        min_time = self._flow_time_str(trough_index)
+        max_time = self._flow_time_str(peak_index)
 
         if max_delta != min_delta: # Добавляем условие, чтобы не было одинаковых пиков
             dynamics.append(f"Максимальное давление продавцов было зафиксировано в {min_time} (кумулятивная дельта: {self._fmt(min_delta)}) — это был пик агрессивных продаж, после которого возможно изменение направления.")
@@ -274,16 +463,12 @@ class ReportGenerator:
 
         # Анализ крупных разворотов дельты (фиксация прибыли)
         if max_delta > 0:
-            peak_index = deltas.index(max_delta)
             if peak_index < len(deltas) -1:
-                final_delta = deltas[-1]
                 if (max_delta - final_delta) / max_delta > 0.3: # Если дельта упала более чем на 30% от пика
                     dynamics.append(f"После пика бычьей активности в {max_time} началась разгрузка: кумулятивная дельта резко снизилась, что может быть признаком фиксации прибыли крупными покупателями или сигналом к скорому развороту рынка вниз.")
 
         if min_delta < 0:
-            trough_index = deltas.index(min_delta)
             if trough_index < len(deltas) -1:
-                final_delta = deltas[-1]
                 if (final_delta - min_delta) / abs(min_delta) > 0.3: # Если дельта выросла более чем на 30% от минимума
                     dynamics.append(f"После пика давления продавцов в {min_time} начался откуп: кумулятивная дельта значительно выросла, что может указывать на поглощение продаж и потенциальный отскок или разворот вверх.")
 
@@ -291,7 +476,7 @@ class ReportGenerator:
 
     def _get_key_levels(self) -> list[str]:
         """Определяет ключевые уровни из профиля объема."""
-        poc = self.stats.get('poc')
+        poc = self.poc
         levels = []
         if poc:
             levels.append(f"POC — зона максимального выхода объёма: {self._fmt(poc)}. Это ключевой уровень, который выступает как магнит для цены и отражает зону интереса маркет-мейкера или крупных участников.")
@@ -303,12 +488,11 @@ class ReportGenerator:
     def _get_risk_and_alternative(self) -> list[str]:
         """Определяет потенциальные риски и альтернативные сценарии."""
         risks = []
-        deltas = [item['cumulative_delta'] for item in self.order_flow]
-        if not deltas:
+        if not self._has_flow:
             return ["Нет данных для анализа рисков и альтернативных сценариев."]
-        max_delta = max(deltas)
-        min_delta = min(deltas)
-        final_delta = deltas[-1]
+        deltas = self._deltas
+        # Та же сводка, что и в динамике сессии: повторно по дельте не проходим
+        min_delta, _, max_delta, _, final_delta = self._get_session_summary()
         
         # 1. Резкое падение дельты после пика (разгрузка)
         if max_delta > 0 and (max_delta - final_delta) / max_delta > 0.3:
@@ -318,19 +502,9 @@ class ReportGenerator:
             risks.append("Активный откуп на лоях: после сильного медвежьего давления кумулятивная дельта значительно выросла, что указывает на поглощение продаж и потенциальный отскок или разворот вверх. Это может быть ловушкой для шортистов.")
         
         # 3. Цена закрытия ниже POC или VWAP
-        final_vwap = self.stats.get('final_vwap')
-        poc = self.stats.get('poc')
-        last_price = self.large_trades[-1].get('PRICE') if self.large_trades else None
-        if not last_price and self.volume_profile:
-            last_price_str = self.volume_profile[-1]['PRICE']
-            if '(' in last_price_str and ']' in last_price_str:
-                try:
-                    last_price = float(last_price_str.split(',')[0].replace('(', '').replace('[', ''))
-                except ValueError:
-                    last_price = None
-            else:
-                 last_price = float(last_price_str)
-
+        final_vwap = self.final_vwap
+        poc = self.poc
+        last_price = self.last_price
 
         if final_vwap and last_price:
             if last_price < final_vwap:
@@ -338,25 +512,24 @@ class ReportGenerator:
             elif last_price > final_vwap and abs(last_price - final_vwap) < (final_vwap * 0.0005):
                 risks.append(f"Цена закрытия ({self._fmt(last_price)}) удержалась на VWAP ({self._fmt(final_vwap)}) — это может быть точкой отскока или местом набора позиции крупным игроком.")
 
-        if poc and last_price:
-            try:
-                poc_level = float(str(poc).split('-')[0].strip())
-                if last_price < poc_level:
-                    risks.append(f"Цена закрытия ({self._fmt(last_price)}) ниже POC ({self._fmt(poc)}) — это может быть признаком ложного пробоя POC или того, что уровень перешел под контроль продавцов. Ожидайте продолжения снижения.")
-                elif last_price > poc_level and abs(last_price - poc_level) < (poc_level * 0.0005):
-                     risks.append(f"Цена закрытия ({self._fmt(last_price)}) удержалась на POC ({self._fmt(poc)}) — этот уровень может стать сильной поддержкой (или сопротивлением).")
-            except Exception:
-                pass
+        poc_level = self.poc_level
+        if poc and last_price and poc_level is not None:
+            if last_price < poc_level:
+                risks.append(f"Цена закрытия ({self._fmt(last_price)}) ниже POC ({self._fmt(poc)}) — это может быть признаком ложного пробоя POC или того, что уровень перешел под контроль продавцов. Ожидайте продолжения снижения.")
+            elif last_price > poc_level and abs(last_price - poc_level) < (poc_level * 0.0005):
+                 risks.append(f"Цена закрытия ({self._fmt(last_price)}) удержалась на POC ({self._fmt(poc)}) — этот уровень может стать сильной поддержкой (или сопротивлением).")
 
         # 4. Резкое падение дельты в самом конце периода
         if len(deltas) > 5 and final_delta < deltas[-5]:
             risks.append("В конце сессии кумулятивная дельта резко ушла вниз — это может указывать на агрессивный сквиз продавцов и выбивание части лонгистов. Будьте готовы к сильному импульсу против тренда.")
         
         # 5. Крупные продажи/покупки на экстремумах
-        if self.large_trades:
-            last_trades = self.large_trades[-10:]
-            max_price_trade = max(last_trades, key=lambda x: x['PRICE'])
-            min_price_trade = min(last_trades, key=lambda x: x['PRICE'])
+        if self._has_trades:
+            # Экстремумы цены последних 10 сделок по массиву цен (первое вхождение, как у max/min)
+            tail_start = max(len(self.large_trades) - 10, 0)
+            tail_prices = self.lt['price'][tail_start:]
+            max_price_trade = self.large_trades[tail_start + int(tail_prices.argmax())]
+            min_price_trade = self.large_trades[tail_start + int(tail_prices.argmin())]
 
             if max_price_trade['BUYSELL'] == 'S':
                 risks.append(f"В финале сессии (на максимумах) прошла серия агрессивных продаж по {max_price_trade['PRICE']} — это может быть кульминацией бычьего движения и сменой сценария. Ищите подтверждение для шорта.")
@@ -371,60 +544,122 @@ class ReportGenerator:
             risks.append("Явных признаков манипуляций и разворота не обнаружено. Продолжайте следить за выходом объёма и реакцией цены на ключевых уровнях.")
         return risks
 
-    def generate_full_report(self) -> str:
-        """Генерирует полный текстовый отчет."""
-        report_parts = [
-            f"Торговый отчёт по {self.ticker}",
-            self._format_period(),
-            "="*40,
+    # --- Секции отчета: каждая возвращает свои строки вместе с завершающим разделителем ---
+    def _section_1_sentiment(self) -> list[str]:
+        return [
             "1. ОБЩИЙ РЫНОЧНЫЙ СЕНТИМЕНТ: Краткий обзор общего настроения рынка на основе кумулятивной дельты и её сравнения с VWAP.",
             f"- {self._get_overall_sentiment()}",
             f"- {self._get_price_vs_vwap()}",
-            "-"*20,
-            "2. СЦЕНАРИЙ СЕССИИ: Детальный разбор динамики кумулятивной дельты и поведения цены в течение торгового дня.", # Обновленный заголовок
+            _SEP20,
         ]
-        report_parts.extend([f"- {line}" for line in self._analyze_session_dynamics()])
-        report_parts.append("-"*20)
-        report_parts.append("3. КЛЮЧЕВЫЕ УРОВНИ: Определение наиболее значимых ценовых уровней на основе объёмного анализа.") # Обновленный заголовок
-        report_parts.extend([f"- {line}" for line in self._get_key_levels()])
-        report_parts.append("-"*20)
-        report_parts.append("4. ТОРГОВЫЕ УРОВНИ И ЗОНЫ СЛАБОСТИ: Выявление зон, где произошло поглощение агрессии одной из сторон, что может сигнализировать о развороте.") # Обновленный заголовок
-        report_parts.append(self._get_trade_levels_block())
-        report_parts.append("-"*20)
-        report_parts.append("5. ТОП-агрессивные сделки (выходы объёма): Наиболее крупные сделки, которые могут указывать на активность крупных игроков.") # Единый заголовок
-        report_parts.append(self._get_top_trades_block(top_n=3)) # Выводим только топ-3 агрессивные сделки
-        
-        culmination = self._find_culmination()
+
+    def _section_2_session(self) -> list[str]:
+        lines = ["2. СЦЕНАРИЙ СЕССИИ: Детальный разбор динамики кумулятивной дельты и поведения цены в течение торгового дня."] # Обновленный заголовок
+        lines.extend([f"- {line}" for line in self._analyze_session_dynamics()])
+        lines.append(_SEP20)
+        return lines
+
+    def _section_3_key_levels(self) -> list[str]:
+        lines = ["3. КЛЮЧЕВЫЕ УРОВНИ: Определение наиболее значимых ценовых уровней на основе объёмного анализа."] # Обновленный заголовок
+        lines.extend([f"- {line}" for line in self._get_key_levels()])
+        lines.append(_SEP20)
+        return lines
+
+    def _section_4_trade_levels(self) -> list[str]:
+        lines = ["4. ТОРГОВЫЕ УРОВНИ И ЗОНЫ СЛАБОСТИ: Выявление зон, где произошло поглощение агрессии одной из сторон, что может сигнализировать о развороте."] # Обновленный заголовок
+        lines.extend(self._get_trade_levels_block())
+        lines.append(_SEP20)
+        return lines
+
+    def _section_5_top_trades(self) -> list[str]:
+        lines = ["5. ТОП-агрессивные сделки (выходы объёма): Наиболее крупные сделки, которые могут указывать на активность крупных игроков."] # Единый заголовок
+        lines.extend(self._get_top_trades_block(top_n=3)) # Выводим только топ-3 агрессивные сделки
+        culmination = self._find_culmination() if self._has_trades else None
         if culmination:
-            report_parts.append(culmination)
-            report_parts.append("-"*20)
-
-        # --- Новый блок: ТОП-50 сделок дня ---
-        report_parts.append("6. ТОП-50 СДЕЛОК ДНЯ: Детализация самых крупных сделок по сумме за весь анализируемый период.") # Обновленный заголовок
-        report_parts.append(self._get_top50_trades_block())
-        report_parts.append("-"*20)
-
-        # --- Новый блок: Признаки маркет-мейкера и алгоритмической торговли ---
-        report_parts.append("7. ПРИЗНАКИ МАРКЕТ-МЕЙКЕРА И АЛГОРИТМИЧЕСКОЙ ТОРГОВЛИ: Анализ паттернов, которые могут указывать на присутствие алгоритмов или маркет-мейкеров на рынке.") # Обновленный заголовок
-        report_parts.extend([f"- {line}" for line in self._get_algo_and_mm_signals()])
-        report_parts.append("-"*20)
-
-        report_parts.extend([
-            "8. РИСКИ, ЛОВУШКИ, МАНИПУЛЯЦИИ: Потенциальные угрозы и сигналы о манипуляциях, на которые стоит обратить внимание.", # Обновленный заголовок
-        ])
-        report_parts.extend([f"- {line}" for line in self._get_risk_and_alternative()])
-        report_parts.append("-"*20)
-        report_parts.extend([
+            lines.append(culmination)
+            lines.append(_SEP20)
+        return lines
+
+    def _section_6_top50(self) -> list[str]:
+        lines = ["6. ТОП-50 СДЕЛОК ДНЯ: Детализация самых крупных сделок по сумме за весь анализируемый период."] # Обновленный заголовок
+        lines.extend(self._get_top50_trades_block())
+        lines.append(_SEP20)
+        return lines
+
+    def _section_7_algo(self) -> list[str]:
+        lines = ["7. ПРИЗНАКИ МАРКЕТ-МЕЙКЕРА И АЛГОРИТМИЧЕСКОЙ ТОРГОВЛИ: Анализ паттернов, которые могут указывать на присутствие алгоритмов или маркет-мейкеров на рынке."] # Обновленный заголовок
+        lines.extend([f"- {line}" for line in self._get_algo_and_mm_signals()])
+        lines.append(_SEP20)
+        return lines
+
+    def _section_8_risks(self) -> list[str]:
+        lines = ["8. РИСКИ, ЛОВУШКИ, МАНИПУЛЯЦИИ: Потенциальные угрозы и сигналы о манипуляциях, на которые стоит обратить внимание."] # Обновленный заголовок
+        lines.extend([f"- {line}" for line in self._get_risk_and_alternative()])
+        lines.append(_SEP20)
+        return lines
+
+    def _section_9_conclusions(self) -> list[str]:
+        """Выводы для трейдера и почасовой мини-анализ в конце отчета."""
+        lines = [
             "9. ВЫВОДЫ ДЛЯ ТРЕЙДЕРА: Краткое резюме основных наблюдений и рекомендации по дальнейшим действиям.", # Обновленный заголовок
             f"- Общее настроение по кумулятивной дельте: {'Бычье' if self.stats.get('delta', 0) > 0 else 'Медвежье' if self.stats.get('delta', 0) < 0 else 'Нейтральное'}.", # Более точное определение настроения
-            f"- Ключевые уровни для мониторинга: POC ({self._fmt(self.stats.get('poc'))}) и VWAP ({self._fmt(self.stats.get('final_vwap', 0))}). Следите за реакцией цены на эти уровни!",
+            f"- Ключевые уровни для мониторинга: POC ({self._fmt(self.poc)}) и VWAP ({self._fmt(self.stats.get('final_vwap', 0))}). Следите за реакцией цены на эти уровни!",
             "- Будьте готовы к резким движениям: рынок любит устраивать сквизы, заколоты уровней и другие манипуляции на объёме. Всегда имейте в виду альтернативный сценарий!",
-            "="*40
-        ])
+            _SEP40
+        ]
         # Почасовой мини-анализ
         hourly_stats = self.data.get('hourly_stats')
         if hourly_stats:
-            report_parts.append("\n--- Почасовой мини-анализ: Детализация по активности в течение каждого часа ---") # Обновленный заголовок
+            lines.append("\n--- Почасовой мини-анализ: Детализация по активности в течение каждого часа ---") # Обновленный заголовок
             for h in hourly_stats:
-                report_parts.append(f"{h['hour']}: Направление - {h['direction']}, дельта {h['delta']:+}, крупных сделок: {h['big_trades']}, объём покупок: {self._fmt(h['buy_vol'])} лотов, объём продаж: {self._fmt(h['sell_vol'])} лотов") # Улучшена читаемость
-        return "\n".join(report_parts)
\ No newline at end of file
+                lines.append(f"{h['hour']}: Направление - {h['direction']}, дельта {h['delta']:+}, крупных сделок: {h['big_trades']}, объём покупок: {self._fmt(h['buy_vol'])} лотов, объём продаж: {self._fmt(h['sell_vol'])} лотов") # Улучшена читаемость
+        return lines
+
+    def generate_full_report(self, sections: Iterable[int] = range(1, 10)) -> str:
+        """
+        Генерирует текстовый отчет: заголовок и секции с номерами из sections (по умолчанию все 1–9).
+        Секции выводятся в порядке номеров; невыбранные не вычисляются вовсе, так что краткий отчет
+        (например, только секции 1–5) не строит ТОП-50 и не запускает AlgoDetector.
+        Строки всех секций собираются в один список и склеиваются один раз.
+        """
+        builders = {
+            1: self._section_1_sentiment,
+            2: self._section_2_session,
+            3: self._section_3_key_levels,
+            4: self._section_4_trade_levels,
+            5: self._section_5_top_trades,
+            6: self._section_6_top50,
+            7: self._section_7_algo,
+            8: self._section_8_risks,
+            9: self._section_9_conclusions,
+        }
+        selected = set(sections)
+        unknown = selected - builders.keys()
+        if unknown:
+            raise ValueError(f"Неизвестные номера секций отчета: {sorted(unknown)}")
+        report_parts = [
+            f"Торговый отчёт по {self.ticker}",
+            self._format_period(),
+            _SEP40,
+        ]
+        for section_id, build in builders.items():
+            if section_id in selected:
+                report_parts.extend(build())
+        return "\n".join(report_parts)
+
+def _generate_one(analysis_data: dict) -> str:
+    """Полный отчет по одному тикеру (функция модуля, чтобы ее можно было передать в пул процессов)."""
+    return ReportGenerator(analysis_data).generate_full_report()
+
+def generate_reports_parallel(data_list, max_workers: int | None = None) -> list[str]:
+    """
+    Генерирует полные отчеты по списку данных анализа (по одному на тикер) в пуле процессов,
+    в обход GIL. Порядок отчетов совпадает с порядком data_list.
+    Небольшие списки (меньше PARALLEL_MIN_REPORTS) и max_workers=1 обрабатываются в текущем процессе.
+    """
+    data_list = list(data_list)
+    if len(data_list) < PARALLEL_MIN_REPORTS or max_workers == 1:
+        return [_generate_one(analysis_data) for analysis_data in data_list]
+    # chunksize > 1: несколько отчетов за одну передачу между процессами
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_generate_one, data_list, chunksize=4))
\ No newline at end of file
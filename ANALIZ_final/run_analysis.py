@@ -1,12 +1,15 @@
 import os
-import json
 from datetime import datetime
 import logging
+import glob
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
 
 from moexparser2 import MOEXDataCollector
-from analiz import TickerAnalyzer, load_trade_files_from_folder, load_trades_from_file
-from plot_report import plot_report
+from analiz import TickerAnalyzer, load_trade_files_from_folder, load_trades_from_file, write_report_json, write_bytes_atomic
+from plot_report import plot_report, load_analysis
 from report_generator import ReportGenerator
 from rank_candidates import run_ranking
 
@@ -15,9 +18,27 @@ CONFIG = {
     "tickers_to_process": [],
     "raw_data_folder": "ANALIZ_final/moex_data",
     "analysis_folder": "ANALIZ_final/analysis_results",
-    "reports_folder": "ANALIZ_final/final_reports"
+    "reports_folder": "ANALIZ_final/final_reports",
+    # Формат сырых файлов со сделками: "json" или "parquet" (требует pyarrow)
+    "trades_format": "json",
+    # Сжимать отчеты анализа zstd (analysis_*.json.zst, требует zstandard)
+    "compress_analysis": False,
+    # Число потоков загрузки сделок с MOEX (запросы ждут сеть, а не CPU)
+    "collect_workers": 12,
+    # Не повторять уже сделанную работу при перезапуске: не собирать сделки, файл которых за сегодня
+    # обновлен менее collect_max_age_hours часов назад, и не пересчитывать анализ и отчеты,
+    # которые новее своих исходных файлов
+    "skip_up_to_date": True,
+    "collect_max_age_hours": 1,
+    # Строить график и текстовый отчет тикера сразу после его анализа, в том же процессе пула шага 2:
+    # отрисовка одних тикеров идет одновременно с анализом других, без ожидания конца всего шага 2.
+    # Шаг 3 тогда достраивает только отчеты, которые старше своих файлов анализа
+    "pipeline_reports": True
 }
 
+# С какого числа файлов анализ и генерация отчетов идут в пуле процессов: на паре тикеров запуск процессов дороже самой работы
+PARALLEL_MIN_FILES = 4
+
 # --- Настройка логирования ---
 logging.basicConfig(
     level=logging.INFO,
@@ -37,28 +58,108 @@ def create_folders():
     ]:
         os.makedirs(folder, exist_ok=True)
 
-def step_1_collect_data():
-    """Шаг 1: Сбор данных с Московской биржи."""
+# Сколько строк прогресса на шаг выводится на уровне INFO (остальные — DEBUG)
+PROGRESS_LOG_STEPS = 20
+
+def _log_progress(i, total, message, *args):
+    """
+    Строка прогресса "(i/total) ..." для i-го элемента (с нуля). На INFO попадают примерно каждые
+    1/PROGRESS_LOG_STEPS элементов и последний, остальные — на DEBUG; аргументы форматируются
+    логгером лениво, только если запись действительно выводится.
+    """
+    done = i + 1
+    level = logging.INFO if done == total or done % max(1, total // PROGRESS_LOG_STEPS) == 0 else logging.DEBUG
+    logging.log(level, "(%d/%d) " + message, done, total, *args)
+
+def _is_up_to_date(output_path, source_path):
+    """True, если output_path существует и записан не раньше source_path — результат можно не пересчитывать."""
+    try:
+        return os.stat(output_path).st_mtime_ns >= os.stat(source_path).st_mtime_ns
+    except FileNotFoundError:
+        return False
+
+def _skip_fresh_trades(instruments, today):
+    """Убирает из списка инструменты, файл сделок которых за today обновлен менее collect_max_age_hours назад."""
+    extension = 'parquet' if CONFIG["trades_format"] == 'parquet' else 'json'
+    max_age = CONFIG["collect_max_age_hours"] * 3600
+    now = time.time()
+    pending = {}
+    for market_type, market_instruments in instruments.items():
+        market_folder = os.path.join(CONFIG["raw_data_folder"], 'trades', market_type)
+        pending[market_type] = []
+        for instrument in market_instruments:
+            trades_path = os.path.join(market_folder, f"{instrument['ticker']}_trades_{today}.{extension}")
+            try:
+                fresh = now - os.stat(trades_path).st_mtime < max_age
+            except FileNotFoundError:
+                fresh = False
+            if not fresh:
+                pending[market_type].append(instrument)
+    skipped = sum(map(len, instruments.values())) - sum(map(len, pending.values()))
+    if skipped:
+        logging.info(f"Пропущено {skipped} инструментов: данные собраны менее {CONFIG['collect_max_age_hours']} ч назад.")
+    return pending
+
+def _get_instruments(collector, today):
+    """
+    Список инструментов MOEX с кэшем на диске на один день (.instruments_cache_YYYY-MM-DD.pkl в папке сырых данных):
+    список меняется не чаще раза в день, поэтому повторные запуски за день не обращаются к ISS.
+    """
+    cache_path = os.path.join(CONFIG["raw_data_folder"], f'.instruments_cache_{today}.pkl')
+    try:
+        with open(cache_path, 'rb') as f:
+            instruments = pickle.load(f)
+        logging.info(f"Список инструментов загружен из кэша {cache_path}")
+        return instruments
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.warning(f"Кэш инструментов {cache_path} не прочитан, список будет загружен заново: {e}")
+
+    instruments = collector.get_instruments_list()
+    # Пустой список — признак ошибки загрузки; его не кэшируем, чтобы следующий запуск повторил запрос
+    if instruments['shares'] or instruments['futures']:
+        try:
+            # Кэши прошлых дней больше не нужны
+            for old_path in glob.glob(os.path.join(CONFIG["raw_data_folder"], '.instruments_cache_*.pkl')):
+                os.remove(old_path)
+            write_bytes_atomic(cache_path, pickle.dumps(instruments, protocol=pickle.HIGHEST_PROTOCOL))
+        except Exception as e:
+            logging.warning(f"Не удалось сохранить кэш инструментов {cache_path}: {e}")
+    return instruments
+
+def _collect_and_save(collector, instruments, today):
+    """
+    Загружает сделки по инструментам ({'shares': [...], 'futures': [...]}) в пуле потоков
+    и сохраняет их по мере готовности. Запись на диск идет в основном потоке.
+    """
+    if CONFIG["skip_up_to_date"]:
+        instruments = _skip_fresh_trades(instruments, today)
+    total = len(instruments['shares']) + len(instruments['futures'])
+    # Каждый HTTP-запрос ограничен таймаутом collector.timeout, поэтому зависший тикер не держит поток пула
+    for i, (ticker, market_type, data) in enumerate(
+            collector.fetch_all_trades(instruments, max_workers=CONFIG["collect_workers"])):
+        _log_progress(i, total, "Собраны данные для: %s", ticker)
+        if data:
+            collector.save_data(data, ticker, 'trades', market_type)
+
+def step_1_collect_data(today):
+    """Шаг 1: Сбор данных с Московской биржи. today — дата запуска (YYYY-MM-DD), ключ кэша инструментов."""
     logging.info("--- Шаг 1: Начало сбора данных ---")
-    collector = MOEXDataCollector(data_folder=CONFIG["raw_data_folder"])
+    # Соединений в пуле — по одному на каждый возможный одновременный запрос страницы сделок
+    collector = MOEXDataCollector(data_folder=CONFIG["raw_data_folder"], trades_format=CONFIG["trades_format"],
+                                  max_connections=CONFIG["collect_workers"] * MOEXDataCollector.PAGE_WORKERS)
 
     tickers_to_process = CONFIG["tickers_to_process"]
 
     if not tickers_to_process:
         logging.info("Список тикеров не указан. Собираем данные по всем инструментам.")
         try:
-            instruments = collector.get_instruments_list()
-            all_instruments = instruments['shares'] + instruments['futures']
-            total = len(all_instruments)
+            instruments = _get_instruments(collector, today)
+            total = len(instruments['shares']) + len(instruments['futures'])
             logging.info(f"Найдено {total} инструментов.")
 
-            for i, instrument in enumerate(all_instruments):
-                ticker = instrument['ticker']
-                market_type = 'shares' if instrument in instruments['shares'] else 'futures'
-                logging.info(f"({i+1}/{total}) Сбор данных для: {ticker}")
-                data = collector.get_trades_data(ticker, market_type)
-                if data:
-                    collector.save_data(data, ticker, 'trades', market_type)
+            _collect_and_save(collector, instruments, today)
             logging.info("Сбор данных по всем инструментам завершен.")
         except Exception as e:
             logging.error(f"Ошибка при сборе данных по всем инструментам: {e}", exc_info=True)
@@ -66,19 +167,19 @@ def step_1_collect_data():
     else:
         logging.info(f"Будут обработаны тикеры: {tickers_to_process}")
         try:
-            instruments = collector.get_instruments_list()
-            ticker_map = {inst['ticker']: ('shares' if inst in instruments['shares'] else 'futures')
-                          for inst in instruments['shares'] + instruments['futures']}
+            instruments = _get_instruments(collector, today)
+            # Рынок тикера определяется по списку, из которого он взят, без поиска инструмента
+            # в списке акций (O(N) на каждый тикер); при совпадении тикеров, как и раньше, побеждает фьючерс
+            ticker_map = {inst['ticker']: 'shares' for inst in instruments['shares']}
+            ticker_map.update({inst['ticker']: 'futures' for inst in instruments['futures']})
 
+            selected = {'shares': [], 'futures': []}
             for ticker in tickers_to_process:
                 if ticker in ticker_map:
-                    market_type = ticker_map[ticker]
-                    logging.info(f"Сбор данных для: {ticker}")
-                    data = collector.get_trades_data(ticker, market_type)
-                    if data:
-                        collector.save_data(data, ticker, 'trades', market_type)
+                    selected[ticker_map[ticker]].append({'ticker': ticker})
                 else:
                     logging.warning(f"Тикер {ticker} не найден в списке инструментов.")
+            _collect_and_save(collector, selected, today)
         except Exception as e:
             logging.error(f"Ошибка при сборе данных по указанным тикерам: {e}", exc_info=True)
             return False
@@ -86,8 +187,41 @@ def step_1_collect_data():
     logging.info("--- Шаг 1: Сбор данных завершен ---")
     return True
 
-def step_2_run_analysis():
-    """Шаг 2: Запуск анализа на основе собранных данных."""
+def json_serializer(obj):
+    """Сериализатор для Timestamp/datetime в отчете анализа."""
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    raise TypeError(f"Объект типа {type(obj)} не сериализуем")
+
+def _analyze_file(file_path, ticker, output_filename, report_folders=None):
+    """
+    Анализирует один файл сделок и сохраняет отчет в output_filename (.json или сжатый .json.zst).
+    report_folders — (папка графиков, папка текстовых отчетов): если задано, сразу строит и отчеты шага 3.
+    Функция модуля, чтобы ее можно было передать в пул процессов. Возвращает путь к отчету анализа или None.
+    """
+    try:
+        # Загружаем данные только для одного тикера
+        ticker_df = load_trades_from_file(file_path)
+        if ticker_df is None or ticker_df.empty:
+            logging.warning(f"Файл {os.path.basename(file_path)} пуст или содержит ошибки. Пропускаем.")
+            return None
+
+        analyzer = TickerAnalyzer(ticker_df)
+        report = analyzer.run_full_analysis()
+
+        # Отчет анализа читает программа (шаг 3), а не человек — пишем компактный JSON без отступов
+        write_report_json(report, output_filename, default=json_serializer, indent=False)
+        if report_folders is not None:
+            # Отчеты строятся по только что записанному файлу — в точности как на шаге 3
+            _generate_report(output_filename, ticker, *report_folders)
+        return output_filename
+
+    except Exception as e:
+        logging.error(f"Ошибка при анализе файла {os.path.basename(file_path)}: {e}", exc_info=True)
+        return None
+
+def step_2_run_analysis(today):
+    """Шаг 2: Запуск анализа на основе собранных данных. today — дата запуска (YYYY-MM-DD), имя папки результатов."""
     logging.info("--- Шаг 2: Начало анализа данных ---")
 
     trades_folder = os.path.join(CONFIG["raw_data_folder"], 'trades')
@@ -99,52 +233,88 @@ def step_2_run_analysis():
 
     logging.info(f"Найдено {len(trade_files)} файлов для анализа.")
 
-    def json_serializer(obj):
-        if hasattr(obj, 'isoformat'):
-            return obj.isoformat()
-        raise TypeError(f"Объект типа {type(obj)} не сериализуем")
+    dated_analysis_folder = os.path.join(CONFIG["analysis_folder"], today)
+    os.makedirs(dated_analysis_folder, exist_ok=True)
+    extension = '.json.zst' if CONFIG["compress_analysis"] else '.json'
 
-    for i, file_path in enumerate(trade_files):
+    # Все файлы сделок тикера (за разные дни) пишут один и тот же analysis_<ticker>: как и при
+    # последовательной обработке, результатом остается последний файл в списке — только он и анализируется
+    jobs = {}
+    for file_path in trade_files:
         ticker = os.path.basename(file_path).split('_')[0]
-        logging.info(f"({i+1}/{len(trade_files)}) Анализ файла: {os.path.basename(file_path)}")
+        jobs[ticker] = (file_path, os.path.join(dated_analysis_folder, f'analysis_{ticker}{extension}'))
+    if CONFIG["skip_up_to_date"]:
+        # Отчет анализа новее файла сделок уже построен по этим данным
+        pending = {ticker: job for ticker, job in jobs.items() if not _is_up_to_date(job[1], job[0])}
+        if len(pending) < len(jobs):
+            logging.info(f"Пропущено {len(jobs) - len(pending)} тикеров: анализ новее файлов сделок.")
+        jobs = pending
+
+    if CONFIG["pipeline_reports"]:
+        dated_reports_folder = os.path.join(CONFIG["reports_folder"], today)
+        os.makedirs(dated_reports_folder, exist_ok=True)
+        report_folders = (CONFIG["analysis_folder"], dated_reports_folder)
+    else:
+        report_folders = None
+
+    tickers = list(jobs)
+    n = len(tickers)
+    source_files = [jobs[ticker][0] for ticker in tickers]
+    output_files = [jobs[ticker][1] for ticker in tickers]
+    # Файлы независимы друг от друга — анализ (pandas, CPU) идет в отдельных процессах в обход GIL;
+    # map сохраняет порядок файлов, chunksize > 1 — несколько файлов за одну передачу между процессами
+    if n >= PARALLEL_MIN_FILES:
+        with ProcessPoolExecutor(max_workers=min(os.cpu_count() or 1, n)) as executor:
+            results = list(executor.map(_analyze_file, source_files, tickers, output_files, [report_folders] * n, chunksize=4))
+    else:
+        results = [_analyze_file(file_path, ticker, output_filename, report_folders)
+                   for file_path, ticker, output_filename in zip(source_files, tickers, output_files)]
 
-        try:
-            # Загружаем данные только для одного тикера
-            ticker_df = load_trades_from_file(file_path)
-            if ticker_df is None or ticker_df.empty:
-                logging.warning(f"Файл {os.path.basename(file_path)} пуст или содержит ошибки. Пропускаем.")
-                continue
+    for i, (ticker, output_filename) in enumerate(zip(tickers, results)):
+        if output_filename:
+            _log_progress(i, n, "Анализ для %s сохранен в %s", ticker, output_filename)
 
-            analyzer = TickerAnalyzer(ticker_df)
-            report = analyzer.run_full_analysis()
+    logging.info("--- Шаг 2: Анализ данных завершен ---")
+    return True
 
-            today = datetime.now().strftime('%Y-%m-%d')
-            dated_analysis_folder = os.path.join(CONFIG["analysis_folder"], today)
-            os.makedirs(dated_analysis_folder, exist_ok=True)
-            output_filename = os.path.join(dated_analysis_folder, f'analysis_{ticker}.json')
+def _generate_report(json_path, ticker, plots_folder, dated_reports_folder):
+    """
+    Строит график и текстовый отчет по одному файлу анализа.
+    Функция модуля, чтобы ее можно было передать в пул процессов. Возвращает путь к отчету или None.
+    """
+    try:
+        # Файл анализа читается один раз: тот же словарь получают и график, и генератор текстового отчета.
+        # orjson (если установлен) разбирает байты файла напрямую, без json.load и декодирования в str
+        data = load_analysis(json_path)
+        plot_report(json_path, output_folder=plots_folder, data=data)
 
-            with open(output_filename, 'w', encoding='utf-8') as f:
-                json.dump(report, f, indent=4, default=json_serializer)
-            logging.info(f"Анализ для {ticker} сохранен в {output_filename}")
+        generator = ReportGenerator(data)
+        text_report = generator.generate_full_report()
 
-        except Exception as e:
-            logging.error(f"Ошибка при анализе файла {os.path.basename(file_path)}: {e}", exc_info=True)
+        report_filename = os.path.join(dated_reports_folder, f'report_{ticker}.txt')
+        # Текст кодируется целиком и пишется одним вызовом (атомарно — шаг 4 не увидит недописанный отчет);
+        # переводы строк — как при записи в текстовом режиме
+        write_bytes_atomic(report_filename, text_report.replace('\n', os.linesep).encode('utf-8'))
+        return report_filename
 
-    logging.info("--- Шаг 2: Анализ данных завершен ---")
-    return True
+    except Exception as e:
+        logging.error(f"Ошибка при генерации отчета для {ticker}: {e}", exc_info=True)
+        return None
 
-def step_3_generate_reports():
-    """Шаг 3: Генерация графических и текстовых отчетов."""
+def step_3_generate_reports(today):
+    """Шаг 3: Генерация графических и текстовых отчетов по анализу за дату today (YYYY-MM-DD)."""
     logging.info("--- Шаг 3: Начало генерации отчетов ---")
 
-    today = datetime.now().strftime('%Y-%m-%d')
     today_folder = os.path.join(CONFIG["analysis_folder"], today)
     if os.path.exists(today_folder):
-        analysis_files = [
-            os.path.join(today_folder, f)
-            for f in os.listdir(today_folder)
-            if f.startswith('analysis_') and f.endswith('.json')
-        ]
+        # DirEntry уже содержит имя и полный путь — без отдельного os.path.join по каждому файлу;
+        # тикер из имени analysis_<ticker>.json[.zst] разбирается здесь один раз и дальше передается вместе с путем
+        with os.scandir(today_folder) as entries:
+            analysis_files = [
+                (entry.path, entry.name.removeprefix('analysis_').removesuffix('.zst').removesuffix('.json'))
+                for entry in entries
+                if entry.name.startswith('analysis_') and entry.name.endswith(('.json', '.json.zst')) and entry.is_file()
+            ]
     else:
         analysis_files = []
 
@@ -154,40 +324,45 @@ def step_3_generate_reports():
 
     logging.info(f"Найдено {len(analysis_files)} файлов для генерации отчетов.")
 
-    for i, json_path in enumerate(analysis_files):
-        ticker = os.path.basename(json_path).replace('analysis_', '').replace('.json', '')
-        logging.info(f"({i+1}/{len(analysis_files)}) Генерация отчета для: {ticker}")
+    dated_reports_folder = os.path.join(CONFIG["reports_folder"], today)
+    os.makedirs(dated_reports_folder, exist_ok=True)
 
-        try:
-            plot_report(json_path, output_folder=CONFIG["analysis_folder"])
-            logging.info(f"График для {ticker} сохранен.")
-
-            with open(json_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            generator = ReportGenerator(data)
-            text_report = generator.generate_full_report()
-
-            today = datetime.now().strftime('%Y-%m-%d')
-            dated_reports_folder = os.path.join(CONFIG["reports_folder"], today)
-            os.makedirs(dated_reports_folder, exist_ok=True)
-            report_filename = os.path.join(dated_reports_folder, f'report_{ticker}.txt')
-            with open(report_filename, 'w', encoding='utf-8') as f:
-                f.write(text_report)
-            logging.info(f"Текстовый отчет для {ticker} сохранен в {report_filename}")
+    # При pipeline_reports шаг 2 уже построил отчеты по всем файлам, которые он записал,
+    # поэтому актуальные отчеты пропускаются и без skip_up_to_date
+    if CONFIG["skip_up_to_date"] or CONFIG["pipeline_reports"]:
+        # Текстовый отчет новее файла анализа уже построен (вместе с графиком) по этим данным
+        pending = [
+            (json_path, ticker) for json_path, ticker in analysis_files
+            if not _is_up_to_date(os.path.join(dated_reports_folder, f'report_{ticker}.txt'), json_path)
+        ]
+        if len(pending) < len(analysis_files):
+            logging.info(f"Пропущено {len(analysis_files) - len(pending)} отчетов: они новее файлов анализа.")
+        analysis_files = pending
+
+    # Отрисовка графика (matplotlib, бэкенд Agg) и текст отчета — работа CPU, процессы идут в обход GIL.
+    # Каждый процесс переиспользует свою фигуру plot_report; больше 8 процессов упираются в запись PNG на диск
+    n = len(analysis_files)
+    json_paths = [json_path for json_path, _ in analysis_files]
+    tickers = [ticker for _, ticker in analysis_files]
+    if n >= PARALLEL_MIN_FILES:
+        with ProcessPoolExecutor(max_workers=min(8, os.cpu_count() or 1, n)) as executor:
+            results = list(executor.map(_generate_report, json_paths, tickers, [CONFIG["analysis_folder"]] * n,
+                                        [dated_reports_folder] * n, chunksize=2))
+    else:
+        results = [_generate_report(json_path, ticker, CONFIG["analysis_folder"], dated_reports_folder)
+                   for json_path, ticker in analysis_files]
 
-        except Exception as e:
-            logging.error(f"Ошибка при генерации отчета для {ticker}: {e}", exc_info=True)
+    for i, (ticker, report_filename) in enumerate(zip(tickers, results)):
+        if report_filename:
+            _log_progress(i, n, "График и текстовый отчет для %s сохранены, отчет: %s", ticker, report_filename)
 
     logging.info("--- Шаг 3: Генерация отчетов завершена ---")
     return True
 
-def step_4_rank_candidates():
-    """Шаг 4: Ранжирование кандидатов на основе отчетов."""
+def step_4_rank_candidates(today):
+    """Шаг 4: Ранжирование кандидатов на основе отчетов за дату today (YYYY-MM-DD)."""
     logging.info("--- Шаг 4: Начало ранжирования кандидатов ---")
     try:
-        from datetime import datetime
-        today = datetime.now().strftime('%Y-%m-%d')
         today_reports_folder = os.path.join(CONFIG["reports_folder"], today)
         run_ranking(today_reports_folder)
         logging.info("--- Шаг 4: Ранжирование кандидатов завершено ---")
@@ -202,10 +377,14 @@ def main():
 
     create_folders()
 
-    if step_1_collect_data():
-        if step_2_run_analysis():
-            if step_3_generate_reports():
-                step_4_rank_candidates()
+    # Дата запуска фиксируется один раз: если конвейер переходит через полночь,
+    # шаги 3 и 4 читают те же папки, в которые писал шаг 2
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    # Каждый шаг выполняется, только если предыдущий завершился успешно
+    for step in (step_1_collect_data, step_2_run_analysis, step_3_generate_reports, step_4_rank_candidates):
+        if not step(today):
+            break
 
     logging.info("=== Автоматический анализ завершен ===")
 